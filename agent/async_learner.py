@@ -0,0 +1,151 @@
+import threading
+from collections import deque
+from keras import backend as K
+from keras.models import clone_model
+
+
+class AsyncLearner(object):
+    """
+    Run replay updates of RL agents in a background thread, decoupled from environment stepping.
+
+    The env loop keeps acting with actor copies of the models (agent.actor_model), pushes the transitions of each
+    decision into the agents' memories, and reports the decision with notify(). Meanwhile the learner thread
+    trains agent.model with agent.replay(), and actor models get the trained weights every sync_freq decisions.
+    The learner copies the weights of a model after each of its replays, so syncing never waits for a replay.
+
+    The learner goes through the reported decisions in order, with the schedule of the run scripts: after a
+    decision bringing the number of transitions to T, a learner runs replay_ratio replays if
+    T % update_model_freq == update_model_freq - 1, and updates its target network if
+    T % update_target_model_freq == update_target_model_freq - 1, both once T > learning_start.
+    Staleness is bounded in both directions: the learner never handles a decision before it is reported, and
+    with max_lag, notify() blocks while the learner is more than max_lag decisions behind. With replay_ratio=1,
+    learners do the same replays and target updates as in synchronous training, max_lag=0 also keeps them in step.
+
+    Parameters
+    ----------
+    learners : list of agents with model, fused_model, memory, replay(), update_target_network(),
+               learning_start, update_model_freq and update_target_model_freq. Agents sharing one model share
+               one actor model
+    replay_ratio : number of replays of a learner each time the schedule calls for one
+    sync_freq : number of decisions between two weight syncs of the actor models, each sync sets the weights
+                of the models trained since the last one
+    max_lag : None or max number of decisions the learner can be behind the actor
+    """
+    def __init__(self, learners, replay_ratio=1, sync_freq=10, max_lag=None):
+        self.learners = learners
+        self.replay_ratio = replay_ratio
+        self.sync_freq = sync_freq
+        self.max_lag = max_lag
+
+        # models are built by the main thread, the learner thread has to use the same graph and session
+        self.session = K.get_session()
+        self.graph = self.session.graph
+
+        # actor copies of each distinct model, keras functions are created before the thread starts
+        actor_models = {}
+        for learner in learners:
+            if not id(learner.model) in actor_models:
+                actor_model = clone_model(learner.model)
+                actor_model.set_weights(learner.model.get_weights())
+                actor_model._make_predict_function()
+                learner.model._make_train_function()
+                actor_models[id(learner.model)] = actor_model
+            learner.actor_model = actor_models[id(learner.model)]
+            learner.fused_model._make_predict_function()
+        self.actor_models = list(actor_models.values())
+
+        # held while training a model, e.g. to save the models
+        self.lock = threading.Lock()
+        # held while reading or writing the trained weights not yet synced, by id of the model
+        self.weights_lock = threading.Lock()
+        self.trained_weights = {}
+        self.condition = threading.Condition()
+        self.decisions = 0  # decisions reported by the actor
+        self.transitions = 0  # transitions of these decisions, of all agents
+        self.pending = deque()  # number of transitions after each decision not yet handled by the learner
+        self.updates = 0  # decisions handled by the learner
+        self.synced_decisions = 0
+        self.running = False
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="async_learner")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._check_error()
+
+    def notify(self, transitions):
+        """
+        Report a decision of the env loop, after its transitions (of all agents) were stored in the memories.
+        Syncs the actor models every sync_freq decisions, and blocks while the learner lags more than max_lag
+        """
+        self._check_error()
+        with self.condition:
+            self.decisions += 1
+            self.transitions += transitions
+            self.pending.append(self.transitions)
+            self.condition.notify_all()
+            if self.max_lag is not None:
+                while self.running and self.error is None and self.updates < self.decisions - self.max_lag:
+                    self.condition.wait()
+        self._check_error()
+        if self.decisions - self.synced_decisions >= self.sync_freq:
+            self.sync()
+
+    def sync(self):
+        """
+        Copy the trained weights into the actor models
+        """
+        with self.weights_lock:
+            trained_weights, self.trained_weights = self.trained_weights, {}
+        for actor_model, weights in trained_weights.values():
+            actor_model.set_weights(weights)
+        self.synced_decisions = self.decisions
+
+    def _check_error(self):
+        if self.error is not None:
+            raise Exception("async learner failed: %s" % repr(self.error))
+
+    def _run(self):
+        try:
+            with self.graph.as_default(), self.session.as_default():
+                while True:
+                    with self.condition:
+                        # learn up to the reported decisions, never ahead of them
+                        while self.running and not self.pending:
+                            self.condition.wait()
+                        if not self.running:
+                            return
+                        transitions = self.pending.popleft()
+                        updates = self.updates + 1
+                    # same schedule as the synchronous loop of the run scripts
+                    for learner in self.learners:
+                        if transitions <= learner.learning_start:
+                            continue
+                        with self.lock:
+                            if transitions % learner.update_model_freq == learner.update_model_freq - 1:
+                                for _ in range(self.replay_ratio):
+                                    learner.replay()
+                                weights = learner.model.get_weights()
+                                with self.weights_lock:
+                                    self.trained_weights[id(learner.model)] = (learner.actor_model, weights)
+                            if transitions % learner.update_target_model_freq == learner.update_target_model_freq - 1:
+                                learner.update_target_network()
+                    with self.condition:
+                        self.updates = updates
+                        self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+                self.running = False
+                self.condition.notify_all()
@@ -1,21 +1,49 @@
 from . import RLAgent
+from .replay_memory import ReplayMemory, PrioritizedReplayMemory
 import random
 import numpy as np
-from collections import deque
-from keras.models import Sequential
-from keras.layers import Dense
+from keras.models import Sequential, Model
+from keras.layers import Dense, Input
 from keras.optimizers import Adam, RMSprop, SGD
+from keras.engine.topology import Layer
+from keras import backend as K
 import os
 
 class DQNAgent(RLAgent):
-    def __init__(self, action_space, ob_generator, reward_generator, iid):
+    """
+    DQN agent of one intersection, model and target_model can be given to share parameters between agents.
+    With shared_agent, the agent uses the models and the memory of shared_agent, which is then the only one to
+    train, save and load them: replay() of shared_agent trains on the transitions of all agents sharing it.
+    With prioritized_replay, transitions are sampled by the TD errors of their last replay,
+    and their updates are weighted by importance sampling
+    """
+    def __init__(self, action_space, ob_generator, reward_generator, iid, model=None, target_model=None, memory_size=2000,
+                 prioritized_replay=False, shared_agent=None):
         super().__init__(action_space, ob_generator, reward_generator)
 
         self.iid = iid
 
         self.ob_length = ob_generator.ob_length
 
-        self.memory = deque(maxlen=2000)
+        # agents acting with the model of this agent, their exploration rate follows this one
+        self.sharing_agents = []
+        self.shared_agent = shared_agent
+        if shared_agent is not None:
+            shared_agent.sharing_agents.append(self)
+            model = shared_agent.model
+            target_model = shared_agent.target_model
+
+        self.prioritized_replay = prioritized_replay
+        memory_class = PrioritizedReplayMemory if prioritized_replay else ReplayMemory
+        if shared_agent is not None:
+            self.memory = shared_agent.memory
+        else:
+            self.memory = memory_class(memory_size, [
+                ("ob", (self.ob_length,), np.float32),
+                ("action", (), np.int64),
+                ("reward", (), np.float32),
+                ("next_ob", (self.ob_length,), np.float32)
+            ])
         self.learning_start = 2000
         self.update_model_freq = 1
         self.update_target_model_freq = 20
@@ -27,15 +55,31 @@ class DQNAgent(RLAgent):
         self.learning_rate = 0.005
         self.batch_size = 32
 
-        self.model = self._build_model()
-        self.target_model = self._build_model()
-        self.update_target_network()
+        self.model = model if model is not None else self._build_model()
+        self.target_model = target_model if target_model is not None else self._build_model()
+        if shared_agent is not None:
+            self.fused_model = shared_agent.fused_model
+        else:
+            self.fused_model = self._build_fused_model()
+            self.update_target_network()
+        self.actor_model = self.model
+
+    @property
+    def actor_model(self):
+        # model used to select actions, a copy synced periodically when trained by an AsyncLearner
+        if self.shared_agent is not None:
+            return self.shared_agent.actor_model
+        return self._actor_model
+
+    @actor_model.setter
+    def actor_model(self, model):
+        self._actor_model = model
 
     def get_action(self, ob):
         if np.random.rand() <= self.epsilon:
             return self.action_space.sample()
         ob = self._reshape_ob(ob)
-        act_values = self.model.predict(ob)
+        act_values = self.actor_model.predict(ob)
         return np.argmax(act_values[0])
 
     def sample(self):
@@ -53,6 +97,11 @@ class DQNAgent(RLAgent):
         )
         return model
 
+    def _build_fused_model(self):
+        # predict Q-values of the online model and the target model in one call
+        return Model(inputs=[self.model.input, self.target_model.input],
+                     outputs=[self.model.output, self.target_model.output])
+
     def _reshape_ob(self, ob):
         return np.reshape(ob, (1, -1))
 
@@ -61,26 +110,112 @@ class DQNAgent(RLAgent):
         self.target_model.set_weights(weights)
 
     def remember(self, ob, action, reward, next_ob):
-        self.memory.append((ob, action, reward, next_ob))
-
-    def replay(self):
-        minibatch = random.sample(self.memory, self.batch_size)
-        obs, actions, rewards, next_obs = [np.stack(x) for x in np.array(minibatch).T]
-        target = rewards + self.gamma * np.amax(self.target_model.predict(next_obs), axis=1)
-        target_f = self.model.predict(obs)
-        for i, action in enumerate(actions):
-            target_f[i][action] = target[i]
-        history = self.model.fit(obs, target_f, epochs=1, verbose=0)
-        #print(history.history['loss'])
-        if self.epsilon > self.epsilon_min:
-            self.epsilon *= self.epsilon_decay
+        self.memory.append(ob, action, reward, next_ob)
+
+    def replay(self, num_batches=1):
+        """
+        Train the model on num_batches minibatches, targets of all minibatches are computed at once beforehand
+        """
+        idxes = self.memory.make_index(self.batch_size * num_batches)
+        obs, actions, rewards, next_obs = self.memory.sample_index(idxes)
+        # weights of the sampling probabilities, before priorities are updated
+        weights = self.memory.importance_weights(idxes) if self.prioritized_replay else None
+        target_f, next_q_values = self.fused_model.predict([obs, next_obs], batch_size=len(obs))
+        target = rewards + self.gamma * np.amax(next_q_values, axis=1)
+        if self.prioritized_replay:
+            self.memory.update_priorities(idxes, target - target_f[np.arange(len(actions)), actions])
+        target_f[np.arange(len(actions)), actions] = target
+        for batch in range(num_batches):
+            batch_slice = slice(batch * self.batch_size, (batch + 1) * self.batch_size)
+            sample_weight = weights[batch_slice] if weights is not None else None
+            loss = self.model.train_on_batch(obs[batch_slice], target_f[batch_slice], sample_weight=sample_weight)
+            #print(loss)
+            if self.epsilon > self.epsilon_min:
+                self.epsilon *= self.epsilon_decay
+        for agent in self.sharing_agents:
+            agent.epsilon = self.epsilon
 
     def load_model(self, dir="model/dqn"):
         name = "dqn_agent_{}.h5".format(self.iid)
         model_name = os.path.join(dir, name)
         self.model.load_weights(model_name)
+        if self.actor_model is not self.model:
+            self.actor_model.set_weights(self.model.get_weights())
 
     def save_model(self, dir="model/dqn"):
         name = "dqn_agent_{}.h5".format(self.iid)
         model_name = os.path.join(dir, name)
-        self.model.save_weights(model_name)
\ No newline at end of file
+        self.model.save_weights(model_name)
+
+
+class GroupedDense(Layer):
+    """
+    Apply a group of Dense layers at once, on input of shape (batch, n_groups, input_dim).
+    The layer has no weights of its own, it stacks the kernels and biases of the given Dense layers,
+    so it always computes with their current values and never needs to be synchronized.
+    """
+    def __init__(self, dense_layers, **kwargs):
+        super(GroupedDense, self).__init__(**kwargs)
+        self.dense_layers = dense_layers
+        self.units = dense_layers[0].units
+        self.activation = dense_layers[0].activation
+
+    def call(self, x):
+        kernel = K.stack([layer.kernel for layer in self.dense_layers])  # (n_groups, input_dim, units)
+        bias = K.stack([layer.bias for layer in self.dense_layers])  # (n_groups, units)
+        x = K.permute_dimensions(x, (1, 0, 2))
+        y = K.batch_dot(x, kernel, axes=[2, 1])
+        y = K.permute_dimensions(y, (1, 0, 2)) + bias
+        return self.activation(y)
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], input_shape[1], self.units)
+
+
+class DQNAgentGroup(object):
+    """
+    Select actions of several DQNAgent with one forward pass per kind of agent.
+
+    Agents are grouped by observation length and number of actions. If all agents of a group share one model,
+    their observations are stacked into one batch of that model. Otherwise a stacked model applies the Dense
+    layers of all agents of the group at once with GroupedDense.
+
+    Parameters
+    ----------
+    agents : list of DQNAgent, agents of a group must have the same model structure
+    """
+    def __init__(self, agents):
+        self.agents = agents
+        self.n_agents = len(agents)
+
+        keys = [(agent.ob_length, agent.action_space.n) for agent in agents]
+        self.groups = []
+        for key in sorted(set(keys)):
+            idxes = [agent_id for agent_id, agent_key in enumerate(keys) if agent_key == key]
+            group = [agents[agent_id] for agent_id in idxes]
+            shared = all(agent.actor_model is group[0].actor_model for agent in group)
+            model = group[0].actor_model if shared else self._build_stacked_model(group)
+            self.groups.append((idxes, shared, model))
+
+    @staticmethod
+    def _build_stacked_model(agents):
+        inputs = Input(shape=(len(agents), agents[0].ob_length))
+        x = inputs
+        for depth in range(len(agents[0].actor_model.layers)):
+            x = GroupedDense([agent.actor_model.layers[depth] for agent in agents])(x)
+        return Model(inputs=inputs, outputs=x)
+
+    def get_actions(self, obs):
+        actions = [None] * self.n_agents
+        for idxes, shared, model in self.groups:
+            group_obs = np.reshape([obs[agent_id] for agent_id in idxes], (len(idxes), -1))
+            if shared:
+                act_values = model.predict(group_obs)
+            else:
+                act_values = model.predict(group_obs[np.newaxis])[0]
+            for agent_id, action in zip(idxes, np.argmax(act_values, axis=1).tolist()):
+                actions[agent_id] = action
+        for agent_id, agent in enumerate(self.agents):
+            if np.random.rand() <= agent.epsilon:
+                actions[agent_id] = agent.sample()
+        return actions
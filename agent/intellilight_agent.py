@@ -1,4 +1,5 @@
 from . import RLAgent
+from .intellilight_memory import IntelliLightMemory
 import numpy as np
 from keras.layers import Input, Dense, Conv2D, Flatten, BatchNormalization, Activation, Multiply, Add
 from keras.layers.core import Dropout
@@ -22,6 +23,7 @@ paras = {"LEARNING_RATE": 0.001,
 "SEPARATE_MEMORY": True,
 "PRIORITY_SAMPLING": False,
 "UPDATE_Q_BAR_FREQ": 5,
+"TAU": 1.0,
 "GAMMA": 0.8,
 "GAMMA_PRETRAIN": 0,
 "MAX_MEMORY_LEN": 1000,
@@ -51,11 +53,13 @@ paras = {"LEARNING_RATE": 0.001,
 }
 
 class IntelliLightAgent(RLAgent):
-    def __init__(self, action_space, ob_generator, reward_generator, world, idx):
+    def __init__(self, action_space, ob_generator, reward_generator, world, idx, log_sink=None, save_init_model=True):
         super().__init__(action_space, ob_generator, reward_generator)
 
         self.idx = idx
         self.world = world
+        # None or LogSink, receiving the training samples at verbosity 2
+        self.log_sink = log_sink
 
         self.phase_list = [i for i in range(self.action_space.n)]
 
@@ -76,15 +80,14 @@ class IntelliLightAgent(RLAgent):
         self.num_actions = 2 # action of intellilight
 
         self.q_network = self.build_network()
-        self.save_model("init_model")
+        if save_init_model:
+            self.save_model("init_model")
         self.update_outdated = 0
 
+        # target network, built once and then updated in place by update_network_bar
         self.q_network_bar = self.build_network_from_copy(self.q_network)
         self.q_bar_outdated = 0
-        if not paras["SEPARATE_MEMORY"]:
-            self.memory = self.build_memory()
-        else:
-            self.memory = self.build_memory_separate()
+        self.memory = self.build_memory()
         self.average_reward = None
 
 
@@ -215,6 +218,12 @@ class IntelliLightAgent(RLAgent):
         return [getattr(state, feature_name)
                 for feature_name in paras["LIST_STATE_FEATURE"]]
 
+    def convert_states_to_input(self, states):
+
+        ''' convert batched states of the memory to the format for neural network input'''
+
+        return [states[feature_name] for feature_name in paras["LIST_STATE_FEATURE"]]
+
     def build_network(self):
 
         '''Initialize a Q network'''
@@ -268,111 +277,63 @@ class IntelliLightAgent(RLAgent):
 
         return network
 
-    def build_memory_separate(self):
-        memory_list=[]
-        for i in range(self.num_phases):
-            memory_list.append([[] for j in range(self.num_actions)])
-        return memory_list
-
     def remember(self, state, action, reward, next_state):
-        if paras["SEPARATE_MEMORY"]:
-            ''' log the history separately '''
-            # print(self.memory)
-            # print(state.cur_phase)
-            # print(action)
-            # print(len(self.memory))
-            self.memory[state.cur_phase[0][0]][action].append([state, action, reward, next_state])
-        else:
-            self.memory.append([state, action, reward, next_state])
+        self.memory.remember(state, action, reward, next_state)
 
     def forget(self, if_pretrain):
 
-        if paras["SEPARATE_MEMORY"]:
-            ''' remove the old history if the memory is too large, in a separate way '''
-            for phase_i in range(self.num_phases):
-                for action_i in range(self.num_actions):
-                    if if_pretrain:
-                        random.shuffle(self.memory[phase_i][action_i])
-                    if len(self.memory[phase_i][action_i]) > paras["MAX_MEMORY_LEN"]:
-                        print("length of memory (state {0}, action {1}): {2}, before forget".format(
-                            phase_i, action_i, len(self.memory[phase_i][action_i])))
-                        self.memory[phase_i][action_i] = self.memory[phase_i][action_i][-paras["MAX_MEMORY_LEN"]:]
-                    print("length of memory (state {0}, action {1}): {2}, after forget".format(
-                        phase_i, action_i, len(self.memory[phase_i][action_i])))
-        else:
-            if len(self.memory) > paras["MAX_MEMORY_LEN"]:
-                print("length of memory: {0}, before forget".format(len(self.memory)))
-                self.memory = self.memory[-paras["MAX_MEMORY_LEN"]:]
-            print("length of memory: {0}, after forget".format(len(self.memory)))
-
-    def _cal_average(self, sample_memory):
-
-        list_reward = []
-        average_reward = np.zeros((self.num_phases, self.num_actions))
-        for phase_i in range(self.num_phases):
-            list_reward.append([])
-            for action_i in range(self.num_actions):
-                list_reward[phase_i].append([])
-        for [state, action, reward, _] in sample_memory:
-            phase = state.cur_phase[0][0]
-            list_reward[phase][action].append(reward)
-
-        for phase_i in range(self.num_phases):
-            for action_i in range(self.num_actions):
-                if len(list_reward[phase_i][action_i]) != 0:
-                    average_reward[phase_i][action_i] = np.average(list_reward[phase_i][action_i])
-
-        return average_reward
-
-    def _cal_average_separate(self,sample_memory):
-        ''' Calculate average rewards for different cases '''
-
-        average_reward = np.zeros((self.num_phases, self.num_actions))
-        for phase_i in range(self.num_phases):
-            for action_i in range(self.num_actions):
-                len_sample_memory = len(sample_memory[phase_i][action_i])
-                if len_sample_memory > 0:
-                    list_reward = []
-                    for i in range(len_sample_memory):
-                        state, action, reward, _ = sample_memory[phase_i][action_i][i]
-                        list_reward.append(reward)
-                    average_reward[phase_i][action_i]=np.average(list_reward)
-        return average_reward
-
-    def get_sample(self, memory_slice, dic_state_feature_arrays, Y, gamma, prefix, use_average):
-
-        len_memory_slice = len(memory_slice)
-
-        f_samples = open(os.path.join(paras["PATH_TO_OUTPUT"], "{0}_memory".format(prefix)), "a")
-
-        for i in range(len_memory_slice):
-            state, action, reward, next_state = memory_slice[i]
-            for feature_name in paras["LIST_STATE_FEATURE"]:
-                dic_state_feature_arrays[feature_name].append(getattr(state, feature_name)[0])
-
-            if state.if_terminal:
-                next_estimated_reward = 0
-            else:
-                next_estimated_reward = self._get_next_estimated_reward(next_state)
-            total_reward = reward + gamma * next_estimated_reward
-            if not use_average:
-                target = self.q_network.predict(
-                    self.convert_state_to_input(state))
+        ''' remove the old history if the memory is too large '''
+
+        for bucket, key in enumerate(self.memory.bucket_keys):
+            len_memory = len(self.memory.buckets[bucket])
+            if paras["SEPARATE_MEMORY"]:
+                # in a separate way
+                if if_pretrain:
+                    self.memory.shuffle(bucket)
+                if len_memory > paras["MAX_MEMORY_LEN"]:
+                    print("length of memory (state {0}, action {1}): {2}, before forget".format(key[0], key[1], len_memory))
+                self.memory.forget(bucket, paras["MAX_MEMORY_LEN"])
+                print("length of memory (state {0}, action {1}): {2}, after forget".format(
+                    key[0], key[1], len(self.memory.buckets[bucket])))
             else:
-                target = np.copy(np.array([self.average_reward[state.cur_phase[0][0]]]))
+                if len_memory > paras["MAX_MEMORY_LEN"]:
+                    print("length of memory: {0}, before forget".format(len_memory))
+                self.memory.forget(bucket, paras["MAX_MEMORY_LEN"])
+                print("length of memory: {0}, after forget".format(len(self.memory.buckets[bucket])))
+
+    def get_sample(self, batch, dic_state_feature_arrays, Y, gamma, prefix, use_average):
+        ''' prepare the training inputs and targets of a batch from the memory, with a few batched predicts '''
+
+        states, actions, rewards, next_states = batch
+        len_batch = len(actions)
+        if len_batch == 0:
+            return dic_state_feature_arrays, Y
+
+        Xs = self.convert_states_to_input(states)
+        for feature_name, x in zip(paras["LIST_STATE_FEATURE"], Xs):
+            dic_state_feature_arrays[feature_name].append(x)
+
+        next_estimated_rewards = self._get_next_estimated_rewards(self.convert_states_to_input(next_states))
+        next_estimated_rewards[states["if_terminal"]] = 0
+        total_rewards = rewards + gamma * next_estimated_rewards
+        if not use_average:
+            target = self.q_network.predict(Xs)
+        else:
+            target = self.average_reward[states["cur_phase"][:, 0]]
 
-            pre_target = np.copy(target)
-            target[0][action] = total_reward
-            Y.append(target[0])
+        pre_target = np.copy(target)
+        target[np.arange(len_batch), actions] = total_rewards
+        Y.append(target)
 
+        # one record per batch, with the samples in arrays
+        if self.log_sink is not None and self.log_sink.enabled(2):
+            record = {"prefix": prefix}
             for feature_name in paras["LIST_STATE_FEATURE"]:
                 if "map" not in feature_name:
-                    f_samples.write("{0}\t".format(str(getattr(state, feature_name))))
-            f_samples.write("{0}\t{1}\t{2}\t{3}\t{4}\n".format(
-                str(pre_target), str(target),
-                str(action), str(reward), str(next_estimated_reward)
-            ))
-        f_samples.close()
+                    record[feature_name] = states[feature_name]
+            record.update({"pre_target": pre_target, "target": target, "action": actions, "reward": rewards,
+                           "next_estimated_reward": next_estimated_rewards})
+            self.log_sink.log("samples", record, level=2)
 
         return dic_state_feature_arrays, Y
 
@@ -413,47 +374,45 @@ class IntelliLightAgent(RLAgent):
         Y = []
 
         # get average state-action reward
-        if paras["SEPARATE_MEMORY"]:
-            self.average_reward = self._cal_average_separate(self.memory)
-        else:
-            self.average_reward = self._cal_average(self.memory)
+        self.average_reward = self.memory.average_reward()
 
         # ================ sample memory ====================
-        if paras["SEPARATE_MEMORY"]:
-            for phase_i in range(self.num_phases):
-                for action_i in range(self.num_actions):
-                    sampled_memory = self._sample_memory(
-                        gamma=gamma,
-                        with_priority=paras["PRIORITY_SAMPLING"],
-                        memory=self.memory[phase_i][action_i],
-                        if_pretrain=if_pretrain)
-                    dic_state_feature_arrays, Y = self.get_sample(
-                        sampled_memory, dic_state_feature_arrays, Y, gamma, current_time, use_average)
-        else:
-            sampled_memory = self._sample_memory(
-                gamma=gamma,
+        sampled_buckets, sampled_indices, sampled_actions = [], [], []
+        for bucket in range(len(self.memory.buckets)):
+            indices = self._sample_memory(
                 with_priority=paras["PRIORITY_SAMPLING"],
-                memory=self.memory,
+                bucket=bucket,
                 if_pretrain=if_pretrain)
+            batch = self.memory.get_batch(bucket, indices)
             dic_state_feature_arrays, Y = self.get_sample(
-                sampled_memory, dic_state_feature_arrays, Y, gamma, current_time, use_average)
+                batch, dic_state_feature_arrays, Y, gamma, current_time, use_average)
+            sampled_buckets.append(np.full(len(indices), bucket, dtype=np.int64))
+            sampled_indices.append(indices)
+            sampled_actions.append(batch[1])
         # ================ sample memory ====================
 
-        Xs = [np.array(dic_state_feature_arrays[feature_name]) for feature_name in paras["LIST_STATE_FEATURE"]]
-        Y = np.array(Y)
-        sample_weight = np.ones(len(Y))
+        # samples of each bucket are batched arrays
+        Xs = [np.concatenate(dic_state_feature_arrays[feature_name], axis=0) for feature_name in paras["LIST_STATE_FEATURE"]]
+        Y = np.concatenate(Y, axis=0)
+        sample_order = np.arange(len(Y))
         # shuffle the training samples, especially for different phases and actions
-        Xs, Y, _ = self._unison_shuffled_copies(Xs, Y, sample_weight)
+        Xs, Y, sample_order = self._unison_shuffled_copies(Xs, Y, sample_order)
 
         # ============================  training  =======================================
 
         self.train_network(Xs, Y, current_time, if_pretrain)
+        if paras["PRIORITY_SAMPLING"]:
+            self._update_priorities(Xs, Y, np.concatenate(sampled_buckets)[sample_order],
+                                    np.concatenate(sampled_indices)[sample_order],
+                                    np.concatenate(sampled_actions)[sample_order])
         self.q_bar_outdated += 1
         self.forget(if_pretrain=if_pretrain)
 
-    def _sample_memory(self, gamma, with_priority, memory, if_pretrain):
+    def _sample_memory(self, with_priority, bucket, if_pretrain):
 
-        len_memory = len(memory)
+        ''' return indices of the transitions of bucket to train on '''
+
+        len_memory = len(self.memory.buckets[bucket])
 
         if not if_pretrain:
             sample_size = min(paras["SAMPLE_SIZE"], len_memory)
@@ -462,35 +421,22 @@ class IntelliLightAgent(RLAgent):
 
         if with_priority:
             # sample with priority
-            sample_weight = []
-            for i in range(len_memory):
-                state, action, reward, next_state = memory[i]
-
-                if state.if_terminal:
-                    next_estimated_reward = 0
-                else:
-                    next_estimated_reward = self._get_next_estimated_reward(next_state)
-
-                total_reward = reward + gamma * next_estimated_reward
-                target = self.q_network.predict(
-                    self.convert_state_to_input(state))
-                pre_target = np.copy(target)
-                target[0][action] = total_reward
-
-                # get the bias of current prediction
-                weight = abs(pre_target[0][action] - total_reward)
-                sample_weight.append(weight)
-
-            priority = self._cal_priority(sample_weight)
-            p = random.choices(range(len(priority)), weights=priority, k=sample_size)
-            sampled_memory = np.array(memory)[p]
+            return self.memory.sample_prioritized(bucket, sample_size)
         else:
-            sampled_memory = random.sample(memory, sample_size)
+            return self.memory.sample(bucket, sample_size)
+
+    def _update_priorities(self, Xs, Y, buckets, indices, actions):
 
-        return sampled_memory
+        ''' set priorities of the trained samples from their TD errors under the trained network '''
+
+        q_values = self.q_network.predict(Xs)
+        td_errors = Y[np.arange(len(Y)), actions] - q_values[np.arange(len(Y)), actions]
+        for bucket in np.unique(buckets):
+            self.memory.update_priorities(bucket, indices[buckets == bucket], td_errors[buckets == bucket])
 
     def load_model(self, file_name):
         self.q_network = load_model(os.path.join(paras["PATH_TO_MODEL"], "%s_q_network.h5" % file_name), custom_objects={'Selector': Selector})
+        self.q_network_bar.set_weights(self.q_network.get_weights())
 
     def save_model(self, file_name):
         if not os.path.exists(paras["PATH_TO_MODEL"]):
@@ -499,7 +445,7 @@ class IntelliLightAgent(RLAgent):
 
     def build_memory(self):
 
-        return []
+        return IntelliLightMemory(self.num_phases, self.num_actions, separate=paras["SEPARATE_MEMORY"])
 
     def build_network_from_copy(self, network_copy):
 
@@ -513,14 +459,6 @@ class IntelliLightAgent(RLAgent):
                         loss="mean_squared_error")
         return network
 
-    @staticmethod
-    def _cal_priority(sample_weight):
-        pos_constant = 0.0001
-        alpha = 1
-        sample_weight_np = np.array(sample_weight)
-        sample_weight_np = np.power(sample_weight_np + pos_constant, alpha) / sample_weight_np.sum()
-        return sample_weight_np
-
     @staticmethod
     def _unison_shuffled_copies(Xs, Y, sample_weight):
         p = np.random.permutation(len(Y))
@@ -549,25 +487,27 @@ class IntelliLightAgent(RLAgent):
         q_values = Dense(num_actions, activation="linear", name="q_values_separate_branch_{0}".format(memo))(hidden_1)
         return q_values
 
-    def _get_next_estimated_reward(self, next_state):
+    def _get_next_estimated_rewards(self, next_Xs):
+
+        ''' estimated rewards of a batch of next states, next_Xs as returned by convert_states_to_input '''
 
+        q_values_bar = self.q_network_bar.predict(next_Xs)
         if paras["DDQN"]:
-            a_max = np.argmax(self.q_network.predict(
-                self.convert_state_to_input(next_state))[0])
-            next_estimated_reward = self.q_network_bar.predict(
-                self.convert_state_to_input(next_state))[0][a_max]
-            return next_estimated_reward
+            a_max = np.argmax(self.q_network.predict(next_Xs), axis=1)
+            return q_values_bar[np.arange(len(a_max)), a_max]
         else:
-            next_estimated_reward = np.max(self.q_network_bar.predict(
-                self.convert_state_to_input(next_state))[0])
-            return next_estimated_reward
+            return np.max(q_values_bar, axis=1)
 
     def update_network_bar(self):
 
-        ''' update Q bar '''
+        ''' update Q bar, by copying the weights of Q or by Polyak averaging with TAU < 1 '''
 
         if self.q_bar_outdated >= paras["UPDATE_Q_BAR_FREQ"]:
-            self.q_network_bar = self.build_network_from_copy(self.q_network)
+            weights = self.q_network.get_weights()
+            if paras["TAU"] < 1:
+                weights = [paras["TAU"] * w + (1 - paras["TAU"]) * w_bar
+                           for w, w_bar in zip(weights, self.q_network_bar.get_weights())]
+            self.q_network_bar.set_weights(weights)
             self.q_bar_outdated = 0
 
 
@@ -0,0 +1,255 @@
+import numpy as np
+from .sum_tree import SumTree
+
+
+class _TransitionBuffer(object):
+    """
+    Ring buffer of transitions (state slot, action, reward, next state slot), grown when full,
+    with their sampling priorities in a SumTree. Transitions are addressed by their index from the oldest one.
+    """
+    FIELDS = (("state", np.int64), ("next_state", np.int64), ("action", np.int64), ("reward", np.float64))
+
+    def __init__(self, capacity):
+        for name, dtype in self.FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.priorities = SumTree(capacity)
+        self.max_priority = 1.0
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def positions(self, indices=None):
+        # positions in the arrays of transitions indices, all transitions by default
+        if indices is None:
+            indices = np.arange(self.size)
+        return (self.start + np.asarray(indices, dtype=np.int64)) % len(self.state)
+
+    def indices(self, positions):
+        return (np.asarray(positions, dtype=np.int64) - self.start) % len(self.state)
+
+    def append(self, state, action, reward, next_state):
+        if self.size == len(self.state):
+            self._reorder(self.positions(), 2 * len(self.state))
+        position = (self.start + self.size) % len(self.state)
+        self.state[position] = state
+        self.next_state[position] = next_state
+        self.action[position] = action
+        self.reward[position] = reward
+        self.priorities.update([position], [self.max_priority])
+        self.size += 1
+
+    def truncate(self, max_len):
+        """
+        Drop the oldest transitions beyond max_len, return their (state, next_state) slots
+        """
+        n = self.size - max_len
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64)
+        dropped = self.positions(np.arange(n))
+        slots = np.concatenate([self.state[dropped], self.next_state[dropped]])
+        self.priorities.update(dropped, 0)
+        self.start = (self.start + n) % len(self.state)
+        self.size = max_len
+        return slots
+
+    def shuffle(self):
+        self._reorder(self.positions(np.random.permutation(self.size)), len(self.state))
+
+    def _reorder(self, positions, capacity):
+        # move transitions at positions to the front of arrays of size capacity
+        for name, dtype in self.FIELDS:
+            array = np.zeros(capacity, dtype=dtype)
+            array[:len(positions)] = getattr(self, name)[positions]
+            setattr(self, name, array)
+        priorities = self.priorities.get(positions)
+        self.priorities = SumTree(capacity)
+        self.priorities.update(np.arange(len(positions)), priorities)
+        self.start = 0
+
+
+class IntelliLightMemory(object):
+    """
+    Columnar replay memory of IntelliLight.
+
+    States are stored once in preallocated arrays per feature, with vehicle maps packed into bits,
+    and transitions refer to their state and next state by slot. As the next state of a transition
+    is usually the state of the following one, consecutive transitions share a slot. Slots are
+    reference counted and reused once no transition refers to them.
+
+    Transitions are kept in buckets, one for each (phase, action) with separate, or a single one.
+    Forgetting truncates the ring buffer of a bucket, and sampling returns batched arrays.
+    Transitions can also be sampled by priority, (|TD error| + eps) ** alpha, new ones get the max priority.
+
+    Parameters
+    ----------
+    num_phases : number of phases of the intersection
+    num_actions : number of actions of IntelliLight
+    separate : boolean, whether to keep transitions of each (phase, action) in a separate bucket
+    capacity : initial number of state slots and transitions per bucket, grown on demand
+    alpha : how much prioritization is used by sample_prioritized(), 0 is uniform sampling
+    eps : small positive constant, so that no transition has zero priority
+    """
+    # shape and dtype of the stored features, as in State. vehicle maps are binary occupancy maps
+    FEATURES = {
+        "queue_length": ((8,), np.float64),
+        "num_of_vehicles": ((8,), np.float64),
+        "waiting_time": ((8,), np.float64),
+        "map_feature": ((150, 150, 1), np.uint8),
+        "cur_phase": ((1,), np.int64),
+        "next_phase": ((1,), np.int64),
+        "time_this_phase": ((1,), np.float64),
+    }
+    MAP_FEATURE = "map_feature"
+
+    def __init__(self, num_phases, num_actions, separate=True, capacity=1024, alpha=1, eps=1e-4):
+        self.num_phases = num_phases
+        self.num_actions = num_actions
+        self.separate = separate
+        self.alpha = alpha
+        self.eps = eps
+
+        # state slots
+        self.map_size = int(np.prod(self.FEATURES[self.MAP_FEATURE][0]))
+        self.states = {}
+        for feature_name, (shape, dtype) in self.FEATURES.items():
+            if feature_name == self.MAP_FEATURE:
+                self.states[feature_name] = np.zeros((capacity, (self.map_size + 7) // 8), dtype=np.uint8)
+            else:
+                self.states[feature_name] = np.zeros((capacity,) + shape, dtype=dtype)
+        self.states["if_terminal"] = np.zeros(capacity, dtype=np.bool_)
+        self.refcount = np.zeros(capacity, dtype=np.int64)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+        # the last next state is held until the following transition, which usually starts from it
+        self.last_next_state = None
+        self.last_next_slot = -1
+
+        if separate:
+            self.bucket_keys = [(phase, action) for phase in range(num_phases) for action in range(num_actions)]
+        else:
+            self.bucket_keys = [None]
+        self.buckets = [_TransitionBuffer(capacity) for _ in self.bucket_keys]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def bucket_index(self, phase, action):
+        return phase * self.num_actions + action if self.separate else 0
+
+    def remember(self, state, action, reward, next_state):
+        if state is self.last_next_state:
+            state_slot = self.last_next_slot
+        else:
+            state_slot = self._add_state(state)
+        next_slot = self._add_state(next_state)
+        self.refcount[[state_slot, next_slot]] += 1
+
+        self.refcount[next_slot] += 1
+        if self.last_next_slot >= 0:
+            self._release([self.last_next_slot])
+        self.last_next_state = next_state
+        self.last_next_slot = next_slot
+
+        bucket = self.buckets[self.bucket_index(int(state.cur_phase[0][0]), action)]
+        bucket.append(state_slot, action, reward, next_slot)
+
+    def forget(self, bucket, max_len):
+        """
+        Keep only the max_len newest transitions of bucket
+        """
+        self._release(self.buckets[bucket].truncate(max_len))
+
+    def shuffle(self, bucket):
+        self.buckets[bucket].shuffle()
+
+    def sample(self, bucket, sample_size):
+        """
+        Return indices of sample_size transitions of bucket, sampled uniformly without replacement
+        """
+        return np.random.choice(len(self.buckets[bucket]), sample_size, replace=False)
+
+    def sample_prioritized(self, bucket, sample_size):
+        """
+        Return indices of sample_size transitions of bucket, sampled by priority with replacement
+        """
+        buffer = self.buckets[bucket]
+        if sample_size == 0:
+            return np.zeros(0, dtype=np.int64)
+        return buffer.indices(buffer.priorities.sample(sample_size))
+
+    def update_priorities(self, bucket, indices, td_errors):
+        """
+        Set priorities of the transitions of bucket at indices from their TD errors
+        """
+        buffer = self.buckets[bucket]
+        priorities = np.power(np.abs(td_errors) + self.eps, self.alpha)
+        buffer.priorities.update(buffer.positions(indices), priorities)
+        if len(priorities) > 0:
+            buffer.max_priority = max(buffer.max_priority, float(np.max(priorities)))
+
+    def get_batch(self, bucket, indices=None):
+        """
+        Return (states, actions, rewards, next_states) of the transitions of bucket at indices, all by default.
+        states and next_states are dicts of feature name to batched array, with the shapes of State features
+        """
+        buffer = self.buckets[bucket]
+        positions = buffer.positions(indices)
+        return (self._get_states(buffer.state[positions]), buffer.action[positions],
+                buffer.reward[positions], self._get_states(buffer.next_state[positions]))
+
+    def average_reward(self):
+        """
+        Return (num_phases, num_actions) average rewards of transitions, by phase of their state and action
+        """
+        total = np.zeros((self.num_phases, self.num_actions))
+        count = np.zeros((self.num_phases, self.num_actions))
+        for buffer in self.buckets:
+            positions = buffer.positions()
+            phases = self.states["cur_phase"][buffer.state[positions], 0]
+            np.add.at(total, (phases, buffer.action[positions]), buffer.reward[positions])
+            np.add.at(count, (phases, buffer.action[positions]), 1)
+        average_reward = np.zeros((self.num_phases, self.num_actions))
+        np.divide(total, count, out=average_reward, where=count > 0)
+        return average_reward
+
+    def _add_state(self, state):
+        if not self.free_slots:
+            self._grow()
+        slot = self.free_slots.pop()
+        for feature_name, array in self.states.items():
+            if feature_name == self.MAP_FEATURE:
+                array[slot] = np.packbits(np.asarray(state.map_feature).reshape(-1) != 0)
+            elif feature_name == "if_terminal":
+                array[slot] = state.if_terminal
+            else:
+                array[slot] = np.asarray(getattr(state, feature_name)).reshape(array.shape[1:])
+        return slot
+
+    def _get_states(self, slots):
+        states = {}
+        for feature_name, array in self.states.items():
+            if feature_name == self.MAP_FEATURE:
+                shape, dtype = self.FEATURES[feature_name]
+                states[feature_name] = np.unpackbits(array[slots], axis=1)[:, :self.map_size]\
+                    .reshape((len(slots),) + shape).astype(dtype, copy=False)
+            else:
+                states[feature_name] = array[slots]
+        return states
+
+    def _release(self, slots):
+        slots = np.asarray(slots, dtype=np.int64)
+        np.subtract.at(self.refcount, slots, 1)
+        self.free_slots.extend(np.unique(slots[self.refcount[slots] == 0]).tolist())
+
+    def _grow(self):
+        capacity = len(self.refcount)
+        for feature_name, array in self.states.items():
+            grown = np.zeros((2 * capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:capacity] = array
+            self.states[feature_name] = grown
+        refcount = np.zeros(2 * capacity, dtype=np.int64)
+        refcount[:capacity] = self.refcount
+        self.refcount = refcount
+        self.free_slots.extend(range(2 * capacity - 1, capacity - 1, -1))
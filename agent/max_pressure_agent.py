@@ -10,6 +10,10 @@ class MaxPressureAgent(BaseAgent):
         self.world = world
         self.world.subscribe("lane_count")
         self.ob_generator = ob_generator
+
+        # start and end lane indices of every lanelink of each phase
+        self.phase_start_lanes = [self.I.lanelink_start_lanes[lanelinks] for lanelinks in self.I.phase_lanelinks]
+        self.phase_end_lanes = [self.I.lanelink_end_lanes[lanelinks] for lanelinks in self.I.phase_lanelinks]
         
         # the minimum duration of time of one phase
         self.t_min = 20
@@ -22,7 +26,7 @@ class MaxPressureAgent(BaseAgent):
 
     def get_action(self, ob):
         # get lane pressure
-        lvc = self.world.get_info("lane_count")
+        lvc = self.world.get_lane_snapshot()["lane_count"]
 
         if self.I.current_phase_time < self.t_min:
             return self.I.current_phase
@@ -30,7 +34,7 @@ class MaxPressureAgent(BaseAgent):
         max_pressure = None
         action = -1
         for phase_id in range(len(self.I.phases)):
-            pressure = sum([lvc[start] - lvc[end] for start, end in self.I.phase_available_lanelinks[phase_id]])
+            pressure = lvc[self.phase_start_lanes[phase_id]].sum() - lvc[self.phase_end_lanes[phase_id]].sum()
             if max_pressure is None or pressure > max_pressure:
                 action = phase_id
                 max_pressure = pressure
@@ -1,25 +1,39 @@
 from . import RLAgent
+from .replay_memory import ReplayMemory
 import random
 import numpy as np
-from collections import deque
 from keras.models import Sequential
 from keras.layers import Dense
 from keras.optimizers import Adam, RMSprop, SGD
-from keras.layers import Input, Dense, Conv2D, Flatten
+from keras.layers import Input, Dense, Conv2D, Flatten, Embedding
 from keras.models import Model
 from keras.layers.merge import concatenate
 import os
 
 
 class PressLightAgent(RLAgent):
-    def __init__(self, action_space, ob_generator, reward_generator, iid, world):
+    """
+    PressLight agent of one intersection.
+    With shared=True, the agent only generates observations and rewards, and has no model nor memory of its own:
+    a SharedPressLightAgent then learns and acts for all intersections.
+    """
+    def __init__(self, action_space, ob_generator, reward_generator, iid, world, memory_size=2000, shared=False):
         super().__init__(action_space, ob_generator, reward_generator)
 
         self.iid = iid
 
         self.ob_length = ob_generator.ob_length
-
-        self.memory = deque(maxlen=2000)
+        self.shared = shared
+
+        if not shared:
+            self.memory = ReplayMemory(memory_size, [
+                ("ob", (self.ob_length,), np.float32),
+                ("phase", (1,), np.int64),
+                ("action", (), np.int64),
+                ("reward", (), np.float32),
+                ("next_ob", (self.ob_length,), np.float32),
+                ("next_phase", (1,), np.int64)
+            ])
         self.learning_start = 2000
         self.update_model_freq = 1
         self.update_target_model_freq = 20
@@ -50,6 +64,7 @@ class PressLightAgent(RLAgent):
             "SEPARATE_MEMORY": False,
             "NORMAL_FACTOR": 20,
             "TRAFFIC_FILE": "cross.2phases_rou01_equal_450.xml",
+            "D_EMBEDDING": 8,
         }
         self.dic_traffic_env_conf = {
             "ACTION_PATTERN": "set",
@@ -144,22 +159,33 @@ class PressLightAgent(RLAgent):
             ],
 
         }
-        self.model = self._build_model()
-        self.target_model = self._build_model()
-        self.update_target_network()
+        if not shared:
+            self.model = self._build_model()
+            self.target_model = self._build_model(name_prefix="target_")
+            self.fused_model = self._build_fused_model()
+            self.update_target_network()
+            # model used to select actions, a copy synced periodically when trained by an AsyncLearner
+            self.actor_model = self.model
 
     def get_action(self, phase, ob):
+        self._check_not_shared()
         if np.random.rand() <= self.epsilon:
             return self.action_space.sample()
         ob = self._reshape_ob(ob)
-        act_values = self.model.predict([phase, ob])
+        act_values = self.actor_model.predict([phase, ob])
         return np.argmax(act_values[0])
 
     def sample(self):
         return self.action_space.sample()
 
-    def _build_model(self):
-        '''Initialize a Q network'''
+    def _check_not_shared(self):
+        # agents created with shared=True have no model nor memory of their own
+        if self.shared:
+            raise Exception("PressLightAgent %s is shared, use its SharedPressLightAgent" % self.iid)
+
+    def _build_model(self, num_intersections=None, name_prefix=""):
+        '''Initialize a Q network, shared by num_intersections intersections with an intersection embedding if given.
+        Layer names start with name_prefix, so that the online and target networks can be fused into one model'''
 
         # initialize feature node
         dic_input_node = {}
@@ -170,7 +196,7 @@ class PressLightAgent(RLAgent):
                 _shape = (self.ob_length,)
                 # _shape = (self.dic_traffic_env_conf["DIC_FEATURE_DIM"]["D_"+feature_name.upper()])
             dic_input_node[feature_name] = Input(shape=_shape,
-                                                 name="input_" + feature_name)
+                                                 name=name_prefix + "input_" + feature_name)
 
         # add cnn to image features
         dic_flatten_node = {}
@@ -184,26 +210,39 @@ class PressLightAgent(RLAgent):
         list_all_flatten_feature = []
         for feature_name in self.dic_traffic_env_conf["LIST_STATE_FEATURE"]:
             list_all_flatten_feature.append(dic_flatten_node[feature_name])
-        all_flatten_feature = concatenate(list_all_flatten_feature, axis=1, name="all_flatten_feature")
+        list_input_node = [dic_input_node[feature_name] for feature_name in self.dic_traffic_env_conf["LIST_STATE_FEATURE"]]
+
+        # learned embedding of the intersection, so that a shared network can still tell intersections apart
+        if num_intersections is not None:
+            input_intersection = Input(shape=(1,), name=name_prefix + "input_intersection")
+            embedding = Embedding(num_intersections, self.dic_agent_conf["D_EMBEDDING"],
+                                  name=name_prefix + "intersection_embedding")(
+                input_intersection)
+            list_all_flatten_feature.append(Flatten()(embedding))
+            list_input_node.append(input_intersection)
+        all_flatten_feature = concatenate(list_all_flatten_feature, axis=1, name=name_prefix + "all_flatten_feature")
 
         # shared dense layer, N_LAYER
-        locals()["dense_0"] = Dense(self.dic_agent_conf["D_DENSE"], activation="relu", name="dense_0")(
+        locals()["dense_0"] = Dense(self.dic_agent_conf["D_DENSE"], activation="relu", name=name_prefix + "dense_0")(
             all_flatten_feature)
         for i in range(1, self.dic_agent_conf["N_LAYER"]):
-            locals()["dense_%d" % i] = Dense(self.dic_agent_conf["D_DENSE"], activation="relu", name="dense_%d" % i)(
+            locals()["dense_%d" % i] = Dense(self.dic_agent_conf["D_DENSE"], activation="relu", name=name_prefix + "dense_%d" % i)(
                 locals()["dense_%d" % (i - 1)])
         # dense1 = Dense(self.dic_agent_conf["D_DENSE"], activation="relu", name="dense_1")(all_flatten_feature)
         # dense2 = Dense(self.dic_agent_conf["D_DENSE"], activation="relu", name="dense_2")(dense1)
-        q_values = Dense(self.action_space.n, activation="linear", name="q_values")(
+        q_values = Dense(self.action_space.n, activation="linear", name=name_prefix + "q_values")(
             locals()["dense_%d" % (self.dic_agent_conf["N_LAYER"] - 1)])
-        network = Model(inputs=[dic_input_node[feature_name]
-                                for feature_name in self.dic_traffic_env_conf["LIST_STATE_FEATURE"]],
-                        outputs=q_values)
+        network = Model(inputs=list_input_node, outputs=q_values)
         network.compile(optimizer=RMSprop(lr=self.dic_agent_conf["LEARNING_RATE"]),
                         loss=self.dic_agent_conf["LOSS_FUNCTION"])
         network.summary()
         return network
 
+    def _build_fused_model(self):
+        # predict Q-values of the online model and the target model in one call
+        return Model(inputs=self.model.inputs + self.target_model.inputs,
+                     outputs=[self.model.output, self.target_model.output])
+
     def _reshape_ob(self, ob):
         return np.reshape(ob, (1, -1))
 
@@ -212,33 +251,154 @@ class PressLightAgent(RLAgent):
         return -pressures[self.iid]
 
     def update_target_network(self):
+        self._check_not_shared()
         weights = self.model.get_weights()
         self.target_model.set_weights(weights)
 
     def remember(self, ob, phase, action, reward, next_ob, next_phase):
-        self.memory.append((ob, phase, action, reward, next_ob, next_phase))
-
-    def replay(self):
+        self._check_not_shared()
+        self.memory.append(ob, phase, action, reward, next_ob, next_phase)
+
+    def replay(self, num_batches=1):
+        """
+        Train the model on num_batches minibatches, targets of all minibatches are computed at once beforehand
+        """
+        self._check_not_shared()
         if self.batch_size > len(self.memory):
-            minibatch = self.memory
+            batch_size = len(self.memory)
+            num_batches = 1
+            idxes = np.arange(len(self.memory))
         else:
-            minibatch = random.sample(self.memory, self.batch_size)
-        obs, phases, actions, rewards, next_obs, next_phases = [np.stack(x) for x in np.array(minibatch).T]
-        target = rewards + self.gamma * np.amax(self.target_model.predict([next_phases, next_obs]), axis=1)
-        target_f = self.model.predict([phases, obs])
-        for i, action in enumerate(actions):
-            target_f[i][action] = target[i]
-        history = self.model.fit([phases, obs], target_f, epochs=1, verbose=0)
-        # print(history.history['loss'])
-        if self.epsilon > self.epsilon_min:
-            self.epsilon *= self.epsilon_decay
+            batch_size = self.batch_size
+            idxes = self.memory.make_index(self.batch_size * num_batches)
+        obs, phases, actions, rewards, next_obs, next_phases = self.memory.sample_index(idxes)
+        target_f, next_q_values = self.fused_model.predict([phases, obs, next_phases, next_obs], batch_size=len(obs))
+        target = rewards + self.gamma * np.amax(next_q_values, axis=1)
+        target_f[np.arange(len(actions)), actions] = target
+        for batch in range(num_batches):
+            batch_slice = slice(batch * batch_size, (batch + 1) * batch_size)
+            loss = self.model.train_on_batch([phases[batch_slice], obs[batch_slice]], target_f[batch_slice])
+            # print(loss)
+            if self.epsilon > self.epsilon_min:
+                self.epsilon *= self.epsilon_decay
 
     def load_model(self, dir="model/presslight"):
+        self._check_not_shared()
         name = "presslight_agent_{}.h5".format(self.iid)
         model_name = os.path.join(dir, name)
         self.model.load_weights(model_name)
+        if self.actor_model is not self.model:
+            self.actor_model.set_weights(self.model.get_weights())
 
     def save_model(self, dir="model/presslight"):
+        self._check_not_shared()
         name = "presslight_agent_{}.h5".format(self.iid)
         model_name = os.path.join(dir, name)
         self.model.save_weights(model_name)
+
+
+class SharedPressLightAgent(object):
+    """
+    One PressLight network with shared parameters acting and learning for all intersections.
+    The network has an additional intersection embedding input, transitions of all intersections go into
+    one replay memory, and each replay trains on one batch covering all intersections.
+
+    Parameters
+    ----------
+    agents : list of PressLightAgent created with shared=True, with the same ob_length and action space.
+             They provide observations, rewards and hyperparameters
+    memory_size : capacity of the replay memory, for all intersections
+    """
+    def __init__(self, agents, memory_size=None):
+        self.agents = agents
+        self.n_agents = len(agents)
+        self.ob_length = agents[0].ob_length
+        self.action_space = agents[0].action_space
+        for agent in agents:
+            assert agent.shared
+            assert agent.ob_length == self.ob_length
+            assert agent.action_space.n == self.action_space.n
+
+        self.learning_start = agents[0].learning_start
+        self.update_model_freq = agents[0].update_model_freq
+        self.update_target_model_freq = agents[0].update_target_model_freq
+        self.gamma = agents[0].gamma
+        self.epsilon = agents[0].epsilon
+        self.epsilon_min = agents[0].epsilon_min
+        self.epsilon_decay = agents[0].epsilon_decay
+        # one batch of each agent's batch size per intersection
+        self.batch_size = agents[0].batch_size * self.n_agents
+
+        if memory_size is None:
+            memory_size = 2000 * self.n_agents
+        self.memory = ReplayMemory(memory_size, [
+            ("ob", (self.ob_length,), np.float32),
+            ("phase", (1,), np.int64),
+            ("intersection", (1,), np.int64),
+            ("action", (), np.int64),
+            ("reward", (), np.float32),
+            ("next_ob", (self.ob_length,), np.float32),
+            ("next_phase", (1,), np.int64)
+        ])
+        self.intersections = np.arange(self.n_agents).reshape(-1, 1)
+
+        self.model = agents[0]._build_model(self.n_agents)
+        self.target_model = agents[0]._build_model(self.n_agents, name_prefix="target_")
+        self.fused_model = Model(inputs=self.model.inputs + self.target_model.inputs,
+                                 outputs=[self.model.output, self.target_model.output])
+        self.update_target_network()
+        # model used to select actions, a copy synced periodically when trained by an AsyncLearner
+        self.actor_model = self.model
+
+    def get_actions(self, phases, obs):
+        """
+        Return actions of all intersections, from one forward pass over their current phases and observations
+        """
+        phases = np.reshape(phases, (self.n_agents, 1))
+        obs = np.reshape(obs, (self.n_agents, self.ob_length))
+        act_values = self.actor_model.predict([phases, obs, self.intersections], batch_size=self.n_agents)
+        actions = np.argmax(act_values, axis=1).tolist()
+        for agent_id, agent in enumerate(self.agents):
+            if np.random.rand() <= self.epsilon:
+                actions[agent_id] = agent.sample()
+        return actions
+
+    def remember(self, agent_id, ob, phase, action, reward, next_ob, next_phase):
+        self.memory.append(ob, phase, [agent_id], action, reward, next_ob, next_phase)
+
+    def update_target_network(self):
+        weights = self.model.get_weights()
+        self.target_model.set_weights(weights)
+
+    def replay(self, num_batches=1):
+        """
+        Train the shared model on num_batches minibatches sampled from the transitions of all intersections
+        """
+        if self.batch_size > len(self.memory):
+            batch_size = len(self.memory)
+            num_batches = 1
+            idxes = np.arange(len(self.memory))
+        else:
+            batch_size = self.batch_size
+            idxes = self.memory.make_index(self.batch_size * num_batches)
+        obs, phases, intersections, actions, rewards, next_obs, next_phases = self.memory.sample_index(idxes)
+        target_f, next_q_values = self.fused_model.predict(
+            [phases, obs, intersections, next_phases, next_obs, intersections], batch_size=len(obs))
+        target = rewards + self.gamma * np.amax(next_q_values, axis=1)
+        target_f[np.arange(len(actions)), actions] = target
+        for batch in range(num_batches):
+            batch_slice = slice(batch * batch_size, (batch + 1) * batch_size)
+            self.model.train_on_batch([phases[batch_slice], obs[batch_slice], intersections[batch_slice]],
+                                      target_f[batch_slice])
+            if self.epsilon > self.epsilon_min:
+                self.epsilon *= self.epsilon_decay
+
+    def load_model(self, dir="model/presslight"):
+        model_name = os.path.join(dir, "presslight_shared.h5")
+        self.model.load_weights(model_name)
+        if self.actor_model is not self.model:
+            self.actor_model.set_weights(self.model.get_weights())
+
+    def save_model(self, dir="model/presslight"):
+        model_name = os.path.join(dir, "presslight_shared.h5")
+        self.model.save_weights(model_name)
@@ -0,0 +1,109 @@
+import threading
+import numpy as np
+from .sum_tree import SumTree
+
+class ReplayMemory(object):
+    """
+    Replay memory of fixed capacity, storing each field of the transitions in a preallocated array.
+    When the memory is full, the oldest transitions are overwritten.
+    Appending and sampling are thread-safe, so that a learner thread can sample while transitions are appended.
+
+    Parameters
+    ----------
+    capacity : int, max number of transitions
+    fields : list of (name, shape, dtype), describing each field of a transition
+    """
+    def __init__(self, capacity, fields):
+        self.capacity = int(capacity)
+        self.names = [name for name, _, _ in fields]
+        self.arrays = {name: np.zeros((self.capacity,) + tuple(shape), dtype=dtype) for name, shape, dtype in fields}
+        self.next_idx = 0
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, *values):
+        with self.lock:
+            self._append(values)
+
+    def _append(self, values):
+        # store a transition, the lock must be held. returns its index
+        assert len(values) == len(self.names)
+        idx = self.next_idx
+        for name, value in zip(self.names, values):
+            self.arrays[name][idx] = value
+        self.next_idx = (idx + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return idx
+
+    def clear(self):
+        with self.lock:
+            self.next_idx = 0
+            self.size = 0
+
+    def make_index(self, batch_size):
+        # uniform sampling with replacement
+        return np.random.randint(0, self.size, size=batch_size)
+
+    def sample_index(self, idxes):
+        with self.lock:
+            return tuple(self.arrays[name][idxes] for name in self.names)
+
+    def sample(self, batch_size):
+        return self.sample_index(self.make_index(batch_size))
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    ReplayMemory sampling transitions with probability proportional to their priority, (|TD error| + eps) ** alpha,
+    kept in a SumTree. New transitions get the max priority seen so far, and update_priorities() sets the priorities
+    of sampled transitions from their TD errors after training.
+    importance_weights() returns the importance-sampling weights correcting the bias of this sampling.
+
+    Parameters
+    ----------
+    capacity : int, max number of transitions
+    fields : list of (name, shape, dtype), describing each field of a transition
+    alpha : how much prioritization is used, 0 is uniform sampling
+    eps : small positive constant, so that no transition has zero priority
+    beta : exponent of the importance-sampling weights, 1 fully corrects the non-uniform sampling
+    """
+    def __init__(self, capacity, fields, alpha=0.6, eps=1e-4, beta=0.4):
+        super().__init__(capacity, fields)
+        self.alpha = alpha
+        self.eps = eps
+        self.beta = beta
+        self.priorities = SumTree(self.capacity)
+        self.max_priority = 1.0
+
+    def append(self, *values):
+        with self.lock:
+            idx = self._append(values)
+            self.priorities.update([idx], [self.max_priority])
+
+    def clear(self):
+        super().clear()
+        with self.lock:
+            self.priorities = SumTree(self.capacity)
+            self.max_priority = 1.0
+
+    def make_index(self, batch_size):
+        with self.lock:
+            return self.priorities.sample(batch_size)
+
+    def importance_weights(self, idxes):
+        """
+        Return (size * P(i)) ** -beta of the transitions at idxes, normalized by their max
+        """
+        with self.lock:
+            probabilities = self.priorities.get(idxes) / self.priorities.total()
+            weights = np.power(self.size * probabilities, -self.beta)
+        return weights / np.max(weights)
+
+    def update_priorities(self, idxes, td_errors):
+        priorities = np.power(np.abs(td_errors) + self.eps, self.alpha)
+        with self.lock:
+            self.priorities.update(idxes, priorities)
+            self.max_priority = max(self.max_priority, float(np.max(priorities)))
@@ -11,6 +11,10 @@ class SOTLAgent(BaseAgent):
         self.world = world
         self.world.subscribe("lane_waiting_count")
 
+        # lane indices of all start lanes, and of the start lanes of each phase
+        self.startlanes = self.I.startlane_indices
+        self.phase_startlanes = self.I.phase_startlane_indices
+
         # the minimum duration of time of one phase
         self.t_min = 10
 
@@ -22,12 +26,12 @@ class SOTLAgent(BaseAgent):
         return None
 
     def get_action(self, ob):
-        lane_waiting_count = self.world.get_info("lane_waiting_count")
+        lane_waiting_count = self.world.get_lane_snapshot()["lane_waiting_count"]
 
         action = self.I.current_phase
         if self.I.current_phase_time >= self.t_min:
-            num_green_vehicles = sum([lane_waiting_count[lane] for lane in self.I.phase_available_startlanes[self.I.current_phase]])
-            num_red_vehicles = sum([lane_waiting_count[lane] for lane in self.I.startlanes])
+            num_green_vehicles = lane_waiting_count[self.phase_startlanes[self.I.current_phase]].sum()
+            num_red_vehicles = lane_waiting_count[self.startlanes].sum()
             num_red_vehicles -= num_green_vehicles
 
             if num_green_vehicles <= self.min_green_vehicle and num_red_vehicles > self.max_red_vehicle:
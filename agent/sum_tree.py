@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class SumTree(object):
+    """
+    Binary tree of priorities where each node holds the sum of its children, for prioritized replay.
+    Leaves are stored in tree[size:], the root in tree[1]. Updates and draws are vectorized over batches
+    and cost O(log N) each.
+
+    Parameters
+    ----------
+    capacity : int, number of leaves
+    """
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.size = 1
+        while self.size < self.capacity:
+            self.size *= 2
+        self.depth = self.size.bit_length() - 1
+        self.tree = np.zeros(2 * self.size, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[self.size + np.asarray(indices, dtype=np.int64)]
+
+    def update(self, indices, priorities):
+        """
+        Set priorities of leaves at indices, and update the sums of their ancestors
+        """
+        nodes = self.size + np.asarray(indices, dtype=np.int64).reshape(-1)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Return indices of the leaves where the cumulative sums of priorities reach values
+        """
+        values = np.array(values, dtype=np.float64).reshape(-1)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            # never descend into an empty subtree, which rounding errors could otherwise cause
+            go_right = (values >= self.tree[left]) & (self.tree[left + 1] > 0)
+            values -= self.tree[left] * go_right
+            nodes = left + go_right
+        return nodes - self.size
+
+    def sample(self, batch_size):
+        """
+        Draw batch_size leaf indices with probability proportional to their priorities, stratified over the total
+        """
+        segment = self.total() / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        return self.find(values)
@@ -0,0 +1,2 @@
+from .grid import generate_grid
+from .suite import benchmark_world_construction, benchmark_world_step, benchmark_generators, benchmark_agent
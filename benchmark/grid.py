@@ -0,0 +1,155 @@
+import os
+import json
+
+# road directions: east, north, west, south
+DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+VEHICLE = {
+    "length": 5.0,
+    "width": 2.0,
+    "maxPosAcc": 2.0,
+    "maxNegAcc": 4.5,
+    "usualPosAcc": 2.0,
+    "usualNegAcc": 4.5,
+    "minGap": 2.5,
+    "maxSpeed": 11.11,
+    "headwayTime": 1.5
+}
+
+
+def _intersection_id(i, j):
+    return "intersection_%d_%d" % (i, j)
+
+
+def _road_id(i, j, d):
+    return "road_%d_%d_%d" % (i, j, d)
+
+
+def _phase_filters():
+    # phase 0 is the yellow phase, the others are the usual 8 phases of a 4-way intersection
+    return [
+        lambda link: False,
+        lambda link: link["type"] == "go_straight" and link["direction"] in (0, 2),
+        lambda link: link["type"] == "go_straight" and link["direction"] in (1, 3),
+        lambda link: link["type"] == "turn_left" and link["direction"] in (0, 2),
+        lambda link: link["type"] == "turn_left" and link["direction"] in (1, 3),
+        lambda link: link["direction"] == 0 and link["type"] != "turn_right",
+        lambda link: link["direction"] == 2 and link["type"] != "turn_right",
+        lambda link: link["direction"] == 1 and link["type"] != "turn_right",
+        lambda link: link["direction"] == 3 and link["type"] != "turn_right"
+    ]
+
+
+def generate_grid(rows, cols, path, road_length=300, num_lanes=3, flow_interval=5, seed=0):
+    """
+    Generate a synthetic rows x cols grid scenario (roadnet, flow and CityFlow config files) under path.
+
+    Every signalized intersection has four approaches with left, straight and right lanes and 8 phases plus a yellow phase.
+    Virtual intersections surround the grid, and a straight flow enters each row and column from both sides.
+
+    Parameters
+    ----------
+    rows : number of intersection rows
+    cols : number of intersection columns
+    path : directory to write roadnet.json, flow.json and config.json into
+    road_length : length of every road
+    num_lanes : number of lanes of every road
+    flow_interval : seconds between two vehicles of the same flow
+    seed : random seed of the engine
+
+    Returns path of the config file.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    def interior(i, j):
+        return 1 <= i <= cols and 1 <= j <= rows
+
+    # grid nodes, including virtual intersections on the border but excluding the 4 corners
+    nodes = [(i, j) for i in range(cols + 2) for j in range(rows + 2)
+             if not (i in (0, cols + 1) and j in (0, rows + 1))]
+    node_set = set(nodes)
+
+    roads = []
+    road_directions = {}
+    for i, j in nodes:
+        for d, (dx, dy) in enumerate(DIRECTIONS):
+            ni, nj = i + dx, j + dy
+            if not (ni, nj) in node_set or not (interior(i, j) or interior(ni, nj)):
+                continue
+            road_id = _road_id(i, j, d)
+            road_directions[road_id] = d
+            roads.append({
+                "id": road_id,
+                "points": [{"x": i * road_length, "y": j * road_length}, {"x": ni * road_length, "y": nj * road_length}],
+                "lanes": [{"width": 3, "maxSpeed": 11.11} for _ in range(num_lanes)],
+                "startIntersection": _intersection_id(i, j),
+                "endIntersection": _intersection_id(ni, nj)
+            })
+
+    intersections = []
+    for i, j in nodes:
+        iid = _intersection_id(i, j)
+        in_roads = [road for road in roads if road["endIntersection"] == iid]
+        out_roads = {road_directions[road["id"]]: road for road in roads if road["startIntersection"] == iid}
+        intersection = {
+            "id": iid,
+            "point": {"x": i * road_length, "y": j * road_length},
+            "width": 10,
+            "roads": [road["id"] for road in in_roads] + [road["id"] for road in out_roads.values()],
+            "roadLinks": [],
+            "trafficLight": {"roadLinkIndices": [], "lightphases": []},
+            "virtual": not interior(i, j)
+        }
+        if interior(i, j):
+            links = []
+            for road in in_roads:
+                d = road_directions[road["id"]]
+                turns = [("turn_left", (d + 1) % 4, 0), ("go_straight", d, 1), ("turn_right", (d + 3) % 4, num_lanes - 1)]
+                for link_type, out_direction, start_lane in turns:
+                    if not out_direction in out_roads:
+                        continue
+                    links.append({
+                        "type": link_type,
+                        "startRoad": road["id"],
+                        "endRoad": out_roads[out_direction]["id"],
+                        "direction": d,
+                        "laneLinks": [{"startLaneIndex": start_lane, "endLaneIndex": k, "points": []} for k in range(num_lanes)]
+                    })
+            intersection["roadLinks"] = links
+            phases = []
+            for phase_id, phase_filter in enumerate(_phase_filters()):
+                # right turns are always allowed
+                available = [k for k, link in enumerate(links) if phase_filter(link) or link["type"] == "turn_right"]
+                phases.append({"time": 30 if phase_id else 5, "availableRoadLinks": available})
+            intersection["trafficLight"] = {"roadLinkIndices": list(range(len(links))), "lightphases": phases}
+        intersections.append(intersection)
+
+    flows = []
+    for j in range(1, rows + 1):
+        flows.append([_road_id(i, j, 0) for i in range(0, cols + 1)])
+        flows.append([_road_id(i, j, 2) for i in range(cols + 1, 0, -1)])
+    for i in range(1, cols + 1):
+        flows.append([_road_id(i, j, 1) for j in range(0, rows + 1)])
+        flows.append([_road_id(i, j, 3) for j in range(rows + 1, 0, -1)])
+    flows = [{"vehicle": VEHICLE, "route": route, "interval": flow_interval, "startTime": 0, "endTime": -1} for route in flows]
+
+    with open(os.path.join(path, "roadnet.json"), "w") as f:
+        json.dump({"intersections": intersections, "roads": roads}, f)
+    with open(os.path.join(path, "flow.json"), "w") as f:
+        json.dump(flows, f)
+    config = {
+        "interval": 1.0,
+        "seed": seed,
+        "dir": os.path.join(path, ""),
+        "roadnetFile": "roadnet.json",
+        "flowFile": "flow.json",
+        "rlTrafficLight": True,
+        "saveReplay": False,
+        "roadnetLogFile": "roadnet_log.json",
+        "replayLogFile": "replay.txt"
+    }
+    config_file = os.path.join(path, "config.json")
+    with open(config_file, "w") as f:
+        json.dump(config, f, indent=2)
+    return config_file
@@ -0,0 +1,184 @@
+import time
+import gym
+import numpy as np
+from world import World
+from environment import TSCEnv
+from generator import LaneVehicleGenerator, BatchLaneVehicleGenerator
+
+AGENTS = ["sotl", "max_pressure", "dqn", "presslight"]
+
+
+def benchmark_world_construction(config_file, thread_num=1, repeats=3):
+    """
+    Time World construction, parsing the roadnet and creating the engine
+
+    Parameters
+    ----------
+    config_file : path of CityFlow config file
+    thread_num : number of engine threads
+    repeats : number of constructions to time
+    """
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        world = World(config_file, thread_num=thread_num)
+        durations.append(time.perf_counter() - start)
+    return {
+        "num_intersections": len(world.intersections),
+        "num_lanes": len(world.all_lanes),
+        "seconds": float(np.min(durations))
+    }
+
+
+def benchmark_world_step(config_file, infos, steps=300, thread_num=1):
+    """
+    Time World.step with the given info functions subscribed and read every step
+
+    Parameters
+    ----------
+    config_file : path of CityFlow config file
+    infos : list of info function names to subscribe
+    steps : number of steps to time
+    thread_num : number of engine threads
+    """
+    world = World(config_file, thread_num=thread_num)
+    world.subscribe(infos)
+    world.reset()
+    actions = [0] * len(world.intersections)
+    start = time.perf_counter()
+    for _ in range(steps):
+        world.step(actions)
+        for info in infos:
+            world.get_info(info)
+    seconds = time.perf_counter() - start
+    return {
+        "infos": list(infos),
+        "steps": steps,
+        "seconds": seconds,
+        "steps_per_sec": steps / seconds
+    }
+
+
+def benchmark_generators(config_file, fns=("lane_count",), steps=300, thread_num=1):
+    """
+    Time generating the observation of every intersection each step,
+    with one LaneVehicleGenerator per intersection and with a BatchLaneVehicleGenerator over all of them
+
+    Parameters
+    ----------
+    config_file : path of CityFlow config file
+    fns : info functions of the generators
+    steps : number of steps to time
+    thread_num : number of engine threads
+    """
+    world = World(config_file, thread_num=thread_num)
+    generators = [LaneVehicleGenerator(world, i, list(fns), in_only=True) for i in world.intersections]
+    batch_generator = BatchLaneVehicleGenerator(generators)
+    world.reset()
+    actions = [0] * len(world.intersections)
+    separate, batched = 0., 0.
+    for _ in range(steps):
+        world.step(actions)
+        # fill the info cache first so that only the generators are timed
+        for fn in fns:
+            world.get_info(fn)
+        world.get_lane_snapshot()
+        start = time.perf_counter()
+        for generator in generators:
+            generator.generate()
+        separate += time.perf_counter() - start
+        start = time.perf_counter()
+        batch_generator.generate()
+        batched += time.perf_counter() - start
+    return {
+        "fns": list(fns),
+        "steps": steps,
+        "separate_seconds": separate,
+        "batched_seconds": batched,
+        "separate_obs_per_sec": steps * len(generators) / separate,
+        "batched_obs_per_sec": steps * len(generators) / batched
+    }
+
+
+def _create_agents(name, world):
+    agents = []
+    for i in world.intersections:
+        action_space = gym.spaces.Discrete(len(i.phases))
+        if name == "sotl":
+            from agent import SOTLAgent
+            agents.append(SOTLAgent(action_space, i, world))
+        elif name == "max_pressure":
+            from agent import MaxPressureAgent
+            agents.append(MaxPressureAgent(action_space, i, world, LaneVehicleGenerator(world, i, ["lane_count"], in_only=True)))
+        elif name == "dqn":
+            from agent.dqn_agent import DQNAgent
+            agents.append(DQNAgent(
+                action_space,
+                LaneVehicleGenerator(world, i, ["lane_count"], in_only=True, average=None),
+                LaneVehicleGenerator(world, i, ["lane_waiting_count"], in_only=True, average="all", negative=True),
+                i.id
+            ))
+        elif name == "presslight":
+            from agent.presslight_agent import PressLightAgent
+            agents.append(PressLightAgent(
+                action_space,
+                LaneVehicleGenerator(world, i, ["lane_count"], in_only=True, average=None),
+                LaneVehicleGenerator(world, i, ["lane_waiting_count"], in_only=True, average="all", negative=True),
+                i.id,
+                world
+            ))
+        else:
+            raise Exception("unknown agent %s" % name)
+    # always query the models, instead of exploring randomly
+    for agent in agents:
+        if hasattr(agent, "epsilon"):
+            agent.epsilon = 0
+    return agents
+
+
+def benchmark_agent(config_file, name, steps=300, action_interval=20, thread_num=1):
+    """
+    Time an episode of the given agent controlling every intersection, the way the run_*.py scripts do
+
+    Parameters
+    ----------
+    config_file : path of CityFlow config file
+    name : one of "sotl", "max_pressure", "dqn" and "presslight"
+    steps : number of simulation steps
+    action_interval : steps between two decisions of each agent
+    thread_num : number of engine threads
+    """
+    world = World(config_file, thread_num=thread_num)
+    agents = _create_agents(name, world)
+    env = TSCEnv(world, agents, None)
+    if name == "dqn":
+        from agent.dqn_agent import DQNAgentGroup
+        agent_group = DQNAgentGroup(agents)
+
+    obs = env.reset()
+    decisions, decision_seconds = 0, 0.
+    start = time.perf_counter()
+    i = 0
+    while i < steps:
+        decision_start = time.perf_counter()
+        if name == "dqn":
+            actions = agent_group.get_actions(obs)
+        elif name == "presslight":
+            actions = [agent.get_action([world.intersections[agent_id].current_phase], obs[agent_id])
+                       for agent_id, agent in enumerate(agents)]
+        else:
+            actions = [agent.get_action(obs[agent_id]) for agent_id, agent in enumerate(agents)]
+        decision_seconds += time.perf_counter() - decision_start
+        decisions += len(agents)
+        obs, rewards, dones, info = env.step_interval(actions, action_interval)
+        i += action_interval
+    seconds = time.perf_counter() - start
+    return {
+        "agent": name,
+        "steps": steps,
+        "decisions": decisions,
+        "seconds": seconds,
+        "decision_seconds": decision_seconds,
+        "decisions_per_sec": decisions / seconds,
+        "steps_per_sec": steps / seconds
+    }
@@ -1,6 +1,7 @@
 import gym
 import numpy as np
 import cityflow
+import multiprocessing as mp
 
 class TSCEnv(gym.Env):
     """
@@ -26,21 +27,201 @@ class TSCEnv(gym.Env):
         self.action_space = gym.spaces.MultiDiscrete(action_dims)
 
         self.metric = metric
+        self.profiler = self.world.profiler
 
     def step(self, actions):
         assert len(actions) == self.n_agents
 
-        self.world.step(actions)
+        with self.profiler.timer("env.step"):
+            self.world.step(actions)
 
-        obs = [agent.get_ob() for agent in self.agents]
-        rewards = [agent.get_reward() for agent in self.agents]
+            obs = []
+            for agent in self.agents:
+                with self.profiler.timer("agent.get_ob"):
+                    obs.append(agent.get_ob())
+            rewards = []
+            for agent in self.agents:
+                with self.profiler.timer("agent.get_reward"):
+                    rewards.append(agent.get_reward())
         dones = [False] * self.n_agents
         #infos = {"metric": self.metric.update()}
         infos = {}
 
         return obs, rewards, dones, infos
 
-    def reset(self):
-        self.world.reset()
+    def step_interval(self, actions, interval, reduce="mean"):
+        """
+        Advance the world interval steps with the same actions, e.g. for one decision of the agents.
+        Observations are only generated after the last step, while rewards of every step are accumulated.
+
+        Parameters
+        ----------
+        actions: actions of each agent, kept during the interval
+        interval: number of steps
+        reduce: "mean" or "sum", how rewards of the steps are combined
+
+        Returns obs, rewards (array of shape (n_agents,)), dones and infos after the last step, like step()
+        """
+        assert len(actions) == self.n_agents
+        if not reduce in ["mean", "sum"]:
+            raise Exception("reduce %s not supported" % reduce)
+
+        rewards = np.zeros(self.n_agents, dtype=np.float64)
+        with self.profiler.timer("env.step_interval"):
+            for _ in range(interval):
+                self.world.step(actions)
+                for i, agent in enumerate(self.agents):
+                    with self.profiler.timer("agent.get_reward"):
+                        rewards[i] += agent.get_reward()
+            obs = []
+            for agent in self.agents:
+                with self.profiler.timer("agent.get_ob"):
+                    obs.append(agent.get_ob())
+        if reduce == "mean":
+            rewards /= interval
+        dones = [False] * self.n_agents
+        infos = {}
+
+        return obs, rewards, dones, infos
+
+    def reset(self, snapshot=None):
+        """
+        Reset the world, or restore it from snapshot (see World.snapshot) if given
+        """
+        if snapshot is None:
+            self.world.reset()
+        else:
+            self.world.restore(snapshot)
         obs = [agent.get_ob() for agent in self.agents]
         return obs
+
+def _parallel_env_worker(remote, parent_remote, env_fn, env_id, obs_buffer, reward_buffer, obs_shape):
+    parent_remote.close()
+    n_envs, n_agents, ob_length = obs_shape
+    obs = np.frombuffer(obs_buffer, dtype=np.float32).reshape(obs_shape)[env_id]
+    rewards = np.frombuffer(reward_buffer, dtype=np.float32).reshape((n_envs, n_agents))[env_id]
+    try:
+        env = env_fn()
+        assert env.n_agents == n_agents, "expected %d agents, got %d" % (n_agents, env.n_agents)
+        remote.send(None)
+    except Exception as e:
+        remote.send(e)
+        remote.close()
+        return
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                ob, reward, done, info = env.step(data)
+                obs[:] = ob
+                rewards[:] = reward
+                remote.send((done, info))
+            elif cmd == "step_interval":
+                ob, reward, done, info = env.step_interval(*data)
+                obs[:] = ob
+                rewards[:] = reward
+                remote.send((done, info))
+            elif cmd == "reset":
+                obs[:] = env.reset()
+                remote.send(None)
+            elif cmd == "close":
+                remote.close()
+                break
+    except Exception as e:
+        # the exception is the reply to the failed command, raised again by the parent
+        remote.send(e)
+        remote.close()
+
+class ParallelTSCEnv(object):
+    """
+    Run several TSCEnv built from the same config in worker processes, stepped in lockstep.
+    Observations and rewards are written by the workers into shared memory and returned as stacked arrays.
+
+    Parameters
+    ----------
+    env_fn: function with no argument creating a TSCEnv (with its own World), called in each worker.
+            Agents of these envs are only used to generate observations and rewards.
+    n_envs: number of worker processes
+    n_agents: number of agents in each env
+    ob_length: length of the observation of each agent
+    """
+    def __init__(self, env_fn, n_envs, n_agents, ob_length):
+        self.n_envs = n_envs
+        self.n_agents = n_agents
+        self.ob_length = ob_length
+
+        obs_shape = (n_envs, n_agents, ob_length)
+        self.obs_buffer = mp.RawArray("f", int(np.prod(obs_shape)))
+        self.reward_buffer = mp.RawArray("f", n_envs * n_agents)
+        self.obs = np.frombuffer(self.obs_buffer, dtype=np.float32).reshape(obs_shape)
+        self.rewards = np.frombuffer(self.reward_buffer, dtype=np.float32).reshape((n_envs, n_agents))
+
+        self.remotes, work_remotes = zip(*[mp.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for env_id, (remote, work_remote) in enumerate(zip(self.remotes, work_remotes)):
+            process = mp.Process(target=_parallel_env_worker,
+                                 args=(work_remote, remote, env_fn, env_id, self.obs_buffer, self.reward_buffer, obs_shape))
+            process.daemon = True
+            process.start()
+            work_remote.close()
+            self.processes.append(process)
+        self.closed = False
+
+        self._check_results([remote.recv() for remote in self.remotes])
+
+    def step(self, actions):
+        """
+        actions: array of shape (n_envs, n_agents)
+        return stacked obs of shape (n_envs, n_agents, ob_length), rewards and dones of shape (n_envs, n_agents)
+        and the list of infos of each env
+        """
+        assert len(actions) == self.n_envs
+        for remote, action in zip(self.remotes, actions):
+            remote.send(("step", action))
+        results = self._check_results([remote.recv() for remote in self.remotes])
+        dones = np.array([done for done, _ in results], dtype=bool)
+        infos = [info for _, info in results]
+        return self.obs.copy(), self.rewards.copy(), dones, infos
+
+    def step_interval(self, actions, interval, reduce="mean"):
+        """
+        Call TSCEnv.step_interval in every env, returns like step()
+        """
+        assert len(actions) == self.n_envs
+        for remote, action in zip(self.remotes, actions):
+            remote.send(("step_interval", (action, interval, reduce)))
+        results = self._check_results([remote.recv() for remote in self.remotes])
+        dones = np.array([done for done, _ in results], dtype=bool)
+        infos = [info for _, info in results]
+        return self.obs.copy(), self.rewards.copy(), dones, infos
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        self._check_results([remote.recv() for remote in self.remotes])
+        return self.obs.copy()
+
+    def _check_results(self, results):
+        # workers reply with the exception of a failed command, raise the first one
+        for result in results:
+            if isinstance(result, Exception):
+                self.close()
+                raise result
+        return results
+
+    def close(self):
+        if self.closed:
+            return
+        for remote, process in zip(self.remotes, self.processes):
+            if process.is_alive():
+                try:
+                    remote.send(("close", None))
+                except (BrokenPipeError, EOFError):
+                    # the worker failed and closed its end of the pipe
+                    pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.closed = True
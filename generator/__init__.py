@@ -1,3 +1,3 @@
 from .base import BaseGenerator
-from .lane_vehicle import LaneVehicleGenerator
+from .lane_vehicle import LaneVehicleGenerator, BatchLaneVehicleGenerator
 from .intersection_vehicle import IntersectionVehicleGenerator
\ No newline at end of file
@@ -1,5 +1,4 @@
 import numpy as np
-import math
 # from .base import BaseGenerator
 
 
@@ -11,38 +10,51 @@ class IntersectionVehicleGenerator():
     ----------
     world : World object
     I : Intersection object
-    fns : list of statistics to get,"vehicle_trajectory", "lane_vehicles", "history_vehicles" is needed for result "passed_count" and "passed_time_count",
+    fns : list of statistics to get,"vehicle_trajectory" is needed for result "passed_count" and "passed_time_count",
                                     "vehicle_distance", "lane_vehicles" is needed for result "vehicle_map"
     targets : list of results to return, currently support "vehicle_map": map of vehicles: an image representation of vehicles’ position in this intersection
                                                            "passed_count": total number of vehicles that passed the intersection during time interval ∆t after the last action
                                                            "passed_time_count": total time (in minutes) spent on approaching lanes of vehicles that passed the intersection during time interval ∆t after the last action
              See section 4.2 of the intelliLight paper[Hua Wei et al, KDD'18] for more detailed description on these targets.
     negative : boolean, whether return negative values (mostly for Reward)
+    map_size : number of grids on each side of the vehicle map, the map covers the roads of the intersection
     time_interval: use to calculate
     """
-    def __init__(self, world, I, fns=("vehicle_trajectory", "lane_vehicles", "history_vehicles", "vehicle_distance"), targets=("vehicle_map"), negative=False):
+    def __init__(self, world, I, fns=("vehicle_trajectory", "lane_vehicles", "vehicle_distance"), targets=("vehicle_map"), negative=False, map_size=150):
         self.world = world
         self.I = I
 
 
 
-        # get lanes of intersections
+        # get lanes of intersections, with starting point and direction of each lane
         self.lanes = []
-        self.in_lanes = []
-        self.road_starting_points = {}
-        roads = I.roads
-        for road in roads:
-            from_zero = (road["startIntersection"] == I.id) if self.world.RIGHT else (road["endIntersection"] == I.id)
-            self.road_starting_points[road["id"]] = road["points"][0]
-            self.lanes.append([ road["id"] + "_" + str(i) for i in range(len(road["lanes"]))[::(1 if from_zero else -1)]])
-            if from_zero:
-                self.in_lanes.append([road["id"] + "_" + str(i) for i in range(len(road["lanes"]))[::(1 if from_zero else -1)]])
+        lane_origins = []
+        lane_directions = []
+        road_lengths = []
+        topology = self.world.topology
+        for road in I.road_indices:
+            if self.world.RIGHT:
+                from_zero = topology.road_start_intersection[road] == I.index
+            else:
+                from_zero = topology.road_end_intersection[road] == I.index
+            lanes = topology.road_lane_indices(road, reverse=not from_zero)
+            self.lanes.append([self.world.all_lanes[lane] for lane in lanes])
+            points = topology.road_points[topology.road_point_indptr[road]:topology.road_point_indptr[road] + 2]
+            direction = points[1] - points[0]
+            lane_origins.extend([points[0]] * len(lanes))
+            lane_directions.extend([direction / np.linalg.norm(direction)] * len(lanes))
+            road_lengths.append(topology.road_length[road])
 
         self.all_lanes = [n for a in self.lanes for n in a ]
-        self.all_in_lanes = [n for a in self.in_lanes for n in a]
+        self.lane_origins = np.array(lane_origins).reshape(-1, 2)
+        self.lane_directions = np.array(lane_directions).reshape(-1, 2)
 
-        # print(self.all_lanes)
-        # print(self.all_in_lanes)
+        # the vehicle map is a square centered on the intersection, covering its longest road on each side
+        self.map_size = map_size
+        self.area_length = 2 * max(road_lengths) if road_lengths else 0
+        self.grid_width = self.area_length / map_size
+        self.map_corner = np.array(I.point, dtype=np.float64) - self.area_length / 2
+        self.map_buffer = np.zeros((map_size, map_size), dtype=np.uint8)
 
         # subscribe functions
         self.world.subscribe(fns)
@@ -57,68 +69,9 @@ class IntersectionVehicleGenerator():
 
         self.negative = negative
 
-    def if_vehicle_passed_intersection(self, vehicle_trajectory, current_time, action_interval):
-        def get_target_trajectory(trajectory, last_time, current_time):
-            target = []
-
-            if len(trajectory) == 0:
-                return target
-
-            if trajectory[-1][1] + trajectory[-1][2] < current_time and trajectory[-1][1] + trajectory[-1][2] > last_time: # means this vehicle left the simulator or currently in an intersection in this period
-                target.append(trajectory[-1])
-                target.append(['left'])
-                return target
-
-            for i, traj in enumerate(trajectory):
-                if traj[1] > last_time:
-                    target.append(traj)
-                    if traj[1] - traj[2] > last_time and i > 0:
-                        target.append(trajectory[i - 1])
-
-            return target
-        last_time = current_time - action_interval
-
-        current_trajectory = get_target_trajectory(vehicle_trajectory, last_time, current_time)
-        for i in range(len(current_trajectory)):
-            if current_trajectory[i][0] in self.all_in_lanes:
-                if i + 1 < len(current_trajectory):
-                    return 1
-        return 0
-
-
-
     def get_passed_vehicles(self, fns):
-        vehicle_trajectory = fns["vehicle_trajectory"]
-        history_vehicles = fns["history_vehicles"]
-
-        passed_vehicles = []
-        for vehicle in history_vehicles:
-            if self.if_vehicle_passed_intersection(vehicle_trajectory[vehicle], current_time=self.time, action_interval=self.action_interval):
-                passed_vehicles.append(vehicle)
-        return passed_vehicles
-
-
-    def get_vehicle_position(self, distance, lane):
-        road = lane[:-2]
-        # start_point = list(self.world.all_roads_starting_point[road].values())
-        start_point = list(self.road_starting_points[road].values())
-
-
-        # 0 right, 1 up, 2 left, 3 down
-        direction_code = int(road[-1])
-
-        # 0 x-axis, 1 y-axis
-        way = direction_code % 2
-
-        # 0 1 -> 1,    2 3 -> -1
-        direction = -((direction_code * 2 - 3) / abs(direction_code * 2 - 3))
-
-        cur_position = start_point.copy()
-        distance = int(distance)
-
-        cur_position[way] += direction * distance
-
-        return tuple(cur_position)
+        # records (time, vehicle_id, time_spent_on_lane) of vehicles that left an incoming lane during the last action interval
+        return self.world.tracker.get_passed_vehicles(self.I.id, since=self.time - self.action_interval)
 
 
     def passed_count(self, fns):
@@ -127,53 +80,45 @@ class IntersectionVehicleGenerator():
 
 
     def passed_time_count(self, fns):
-        vehicle_trajectory = fns["vehicle_trajectory"]
         passed_vehicles = self.get_passed_vehicles(fns)
-        # for i in passed_vehicles:
-        #     print(vehicle_trajectory[i])
         passed_time_count = 0
-        for vehicle in passed_vehicles:
-            passed_time_count += vehicle_trajectory[vehicle][-2][2]
+        for _, vehicle, time_spent in passed_vehicles:
+            passed_time_count += time_spent
         return passed_time_count
 
 
     def vehicle_map(self, fns):
-        def vehicle_location_mapper(coordinate, area_length, area_width):
-            transformX = math.floor((coordinate[0] + area_length / 2) / grid_width)
-            length_width_map = float(area_length) / area_width
-            transformY = math.floor((coordinate[1] + area_width / 2) * length_width_map / grid_width)
-            length_num_grids = int(area_length / grid_width)
-            transformY = length_num_grids - 1 if transformY == length_num_grids else transformY
-            transformX = length_num_grids - 1 if transformX == length_num_grids else transformX
-            tempTransformTuple = (transformY, transformX)
-            return tempTransformTuple
-
-        # the length and width of current intersection
-        # TODO get the length and width from RoadNet file
-        area_length = 600
-        area_width = 600
-        grid_width = 4 # hyper parameter, decides the density of the grid
-
-        length_num_grids = int(area_length / grid_width)
-        mapOfCars = np.zeros((length_num_grids, length_num_grids))
-
+        """
+        Return a (map_size, map_size) uint8 map with 1 on grids occupied by vehicles, rows are along y-axis.
+        The returned array is reused and overwritten by the next call.
+        """
         vehicle_distance = fns["vehicle_distance"]
         lane_vehicles = fns["lane_vehicles"]
-        for lane in self.all_lanes:
-            for vehicle in lane_vehicles[lane]:
-                distance = vehicle_distance[vehicle]
-                vehicle_position = self.get_vehicle_position(distance, lane)  # (double,double),tuple
-                if vehicle_position is None:
-                    continue
-                transform_tuple = vehicle_location_mapper(vehicle_position, area_length, area_width)  # transform the coordinates to location in grid
-                mapOfCars[transform_tuple[0], transform_tuple[1]] = 1
 
-        return mapOfCars
+        self.map_buffer.fill(0)
+        # an intersection without roads has an empty map
+        if self.grid_width == 0:
+            return self.map_buffer
+
+        # gather distances of all vehicles on the lanes of the intersection
+        vehicles = [lane_vehicles[lane] for lane in self.all_lanes]
+        lane_vehicle_count = np.array([len(x) for x in vehicles], dtype=np.int64)
+        distances = np.array([vehicle_distance[vehicle] for x in vehicles for vehicle in x], dtype=np.float64)
+        lanes = np.repeat(np.arange(len(self.all_lanes)), lane_vehicle_count)
+
+        # transform positions of vehicles to location in grid
+        positions = self.lane_origins[lanes] + self.lane_directions[lanes] * np.floor(distances)[:, np.newaxis]
+        grids = np.floor((positions - self.map_corner) / self.grid_width).astype(np.int64)
+        grids[grids == self.map_size] = self.map_size - 1
+        valid = np.all((grids >= 0) & (grids < self.map_size), axis=1)
+
+        self.map_buffer[grids[valid, 1], grids[valid, 0]] = 1
+        return self.map_buffer
 
 
     def generate(self, action_interval=5):
         self.action_interval = action_interval
-        self.time = self.world.eng.get_current_time()
+        self.time = self.world.query("current_time")
 
 
 
@@ -1,6 +1,31 @@
 import numpy as np
 from . import BaseGenerator
 
+def _generate_lane_values(world, fns, lane_indices, road_starts, road_lengths, average, negative, lane_buffer, out):
+    """
+    Gather lane statistics of one or several groups of lanes, and reduce them according to average.
+
+    lane_indices are indices in world.all_lanes of all lanes, grouped by road, road_starts and road_lengths
+    describe the roads in lane_indices. out is of shape (n_rows, ob_length), rows of out split roads evenly.
+    """
+    snapshot = world.get_lane_snapshot()
+    n_rows = out.shape[0]
+    size = out.shape[1] // len(fns)
+    for i, fn in enumerate(fns):
+        lane_values = np.take(snapshot[fn], lane_indices, out=lane_buffer)
+        fn_out = out[:, i * size:(i + 1) * size]
+        if average == "road" or average == "all":
+            road_values = np.add.reduceat(lane_values, road_starts) / road_lengths
+            if average == "all":
+                np.mean(road_values.reshape(n_rows, -1), axis=1, out=fn_out[:, 0])
+            else:
+                fn_out[:] = road_values.reshape(n_rows, -1)
+        else:
+            fn_out[:] = lane_values.reshape(n_rows, -1)
+    if negative:
+        np.negative(out, out=out)
+    return out
+
 class LaneVehicleGenerator(BaseGenerator):
     """
     Generate State or Reward based on statistics of lane vehicles.
@@ -21,15 +46,26 @@ class LaneVehicleGenerator(BaseGenerator):
         self.world = world
         self.I = I
 
-        # get lanes of intersections
-        self.lanes = []
+        # get lanes of intersections, as indices in world.all_lanes
+        topology = self.world.topology
         if in_only:
-            roads = I.in_roads
+            roads = I.in_road_indices
         else:
-            roads = I.roads
+            roads = I.road_indices
+        road_lanes = []
         for road in roads:
-            from_zero = (road["startIntersection"] == I.id) if self.world.RIGHT else (road["endIntersection"] == I.id)
-            self.lanes.append([road["id"] + "_" + str(i) for i in range(len(road["lanes"]))[::(1 if from_zero else -1)]])
+            if self.world.RIGHT:
+                from_zero = topology.road_start_intersection[road] == I.index
+            else:
+                from_zero = topology.road_end_intersection[road] == I.index
+            road_lanes.append(topology.road_lane_indices(road, reverse=not from_zero))
+        self.lanes = [[self.world.all_lanes[lane] for lane in lanes] for lanes in road_lanes]
+
+        # start and length of each road among the lane indices
+        self.lane_indices = np.concatenate(road_lanes) if road_lanes else np.zeros(0, dtype=np.int64)
+        self.road_lengths = np.array([len(lanes) for lanes in road_lanes], dtype=np.int64)
+        self.road_starts = np.concatenate([[0], np.cumsum(self.road_lengths)[:-1]]).astype(np.int64)
+        self.lane_buffer = np.empty(len(self.lane_indices), dtype=np.float32)
 
         # subscribe functions
         self.world.subscribe(fns)
@@ -46,30 +82,49 @@ class LaneVehicleGenerator(BaseGenerator):
         self.average = average
         self.negative = negative
 
-    def generate(self):
-        results = [self.world.get_info(fn) for fn in self.fns]
+    def generate(self, out=None):
+        """
+        Return the result as a float32 array of shape (ob_length,), written into out if given.
+        """
+        if out is None:
+            out = np.empty(self.ob_length, dtype=np.float32)
+        _generate_lane_values(self.world, self.fns, self.lane_indices, self.road_starts, self.road_lengths,
+                              self.average, self.negative, self.lane_buffer, out.reshape(1, -1))
+        return out
+
+class BatchLaneVehicleGenerator(BaseGenerator):
+    """
+    Generate the results of several LaneVehicleGenerator at once, as a matrix of shape (n_generators, ob_length).
+
+    Parameters
+    ----------
+    generators : list of LaneVehicleGenerator, with the same fns, average, negative and ob_length
+    """
+    def __init__(self, generators):
+        self.world = generators[0].world
+        self.generators = generators
+        self.fns = generators[0].fns
+        self.average = generators[0].average
+        self.negative = generators[0].negative
+        self.ob_length = generators[0].ob_length
+        for generator in generators:
+            assert list(generator.fns) == list(self.fns) and generator.average == self.average
+            assert generator.negative == self.negative and generator.ob_length == self.ob_length
+            assert len(generator.road_lengths) == len(generators[0].road_lengths)
 
-        ret = np.array([])
-        for i in range(len(self.fns)):
-            result = results[i]
-            fn_result = np.array([])
+        self.lane_indices = np.concatenate([generator.lane_indices for generator in generators])
+        self.road_lengths = np.concatenate([generator.road_lengths for generator in generators])
+        self.road_starts = np.concatenate([[0], np.cumsum(self.road_lengths)[:-1]]).astype(np.int64)
+        self.lane_buffer = np.empty(len(self.lane_indices), dtype=np.float32)
 
-            for road_lanes in self.lanes:
-                road_result = []
-                for lane_id in road_lanes:
-                    road_result.append(result[lane_id])
-                if self.average == "road" or self.average == "all":
-                    road_result = np.mean(road_result)
-                else:
-                    road_result = np.array(road_result)
-                fn_result = np.append(fn_result, road_result)
-            
-            if self.average == "all":
-                fn_result = np.mean(fn_result)
-            ret = np.append(ret, fn_result)
-        if self.negative:
-            ret = ret * (-1)
-        return ret
+    def generate(self, out=None):
+        """
+        Return the results as a float32 array of shape (n_generators, ob_length), written into out if given.
+        """
+        if out is None:
+            out = np.empty((len(self.generators), self.ob_length), dtype=np.float32)
+        return _generate_lane_values(self.world, self.fns, self.lane_indices, self.road_starts, self.road_lengths,
+                                     self.average, self.negative, self.lane_buffer, out)
 
 if __name__ == "__main__":
     from world import World
@@ -77,4 +132,4 @@ if __name__ == "__main__":
     laneVehicle = LaneVehicleGenerator(world, world.intersections[0], ["count"], False, "road")
     for _ in range(100):
         world.step()
-    print(laneVehicle.generate())
\ No newline at end of file
+    print(laneVehicle.generate())
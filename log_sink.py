@@ -0,0 +1,115 @@
+import os
+import json
+import atexit
+import threading
+import numpy as np
+
+
+def _to_json(value):
+    # numpy values are converted by the writer thread
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("%s is not JSON serializable" % type(value).__name__)
+
+
+class LogSink(object):
+    """
+    Buffered structured logging. Records are dicts appended to a named stream with log(), kept in memory,
+    and written by a background thread as JSON lines to log_dir/<stream>.jsonl, so that logging never waits
+    for the disk. Records are serialized by the writer thread, logged arrays must not be modified afterwards.
+
+    Each record has a verbosity level, records above the verbosity of the sink are dropped right away.
+    Levels used by the run scripts: 1 for a record per decision, 2 for a record per training batch.
+
+    Parameters
+    ----------
+    log_dir : directory of the stream files
+    verbosity : max level of the kept records, 0 disables logging
+    flush_interval : max seconds between two writes of the buffered records
+    flush_size : number of buffered records that triggers a write before flush_interval
+    """
+    def __init__(self, log_dir, verbosity=1, flush_interval=1.0, flush_size=1000):
+        self.log_dir = log_dir
+        self.verbosity = verbosity
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self.buffer = []
+        self.logged = 0  # number of records logged
+        self.written = 0  # number of records written
+        self.files = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = None
+        if verbosity > 0:
+            if not os.path.exists(log_dir):
+                os.makedirs(log_dir)
+            self.thread = threading.Thread(target=self._run, name="log_sink")
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def enabled(self, level=1):
+        return level <= self.verbosity and not self.closed
+
+    def log(self, stream, record, level=1):
+        """
+        Append record, a dict of JSON serializable or numpy values, to stream
+        """
+        if not self.enabled(level):
+            return
+        with self.condition:
+            self.buffer.append((stream, record))
+            self.logged += 1
+            if len(self.buffer) >= self.flush_size:
+                self.condition.notify()
+
+    def flush(self):
+        """
+        Block until the records logged so far are written
+        """
+        if self.thread is None:
+            return
+        with self.condition:
+            logged = self.logged
+            while self.written < logged and self.thread.is_alive():
+                self.condition.notify_all()
+                self.condition.wait(self.flush_interval)
+
+    def close(self):
+        if self.closed:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.closed and self.logged - self.written < self.flush_size:
+                    self.condition.wait(self.flush_interval)
+                records, self.buffer = self.buffer, []
+                closed = self.closed
+            self._write(records)
+            with self.condition:
+                self.written += len(records)
+                # wake up flush()
+                self.condition.notify_all()
+            if closed:
+                break
+        for f in self.files.values():
+            f.close()
+
+    def _write(self, records):
+        streams = set()
+        for stream, record in records:
+            if not stream in self.files:
+                self.files[stream] = open(os.path.join(self.log_dir, stream + ".jsonl"), "a")
+            self.files[stream].write(json.dumps(record, default=_to_json) + "\n")
+            streams.add(stream)
+        for stream in streams:
+            self.files[stream].flush()
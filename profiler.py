@@ -0,0 +1,103 @@
+import os
+import csv
+import json
+import time
+import numpy as np
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler(object):
+    """
+    Opt-in wall time instrumentation of named sections, used as `with profiler.timer("name"): ...`.
+    When disabled, timer() returns a shared no-op context manager, so instrumented code costs almost nothing.
+
+    Durations are aggregated until reset(), typically once per episode, and exported with dump().
+
+    Parameters
+    ----------
+    enabled : boolean, whether to record durations
+    bins : number of bins of the exported duration histograms
+    """
+    def __init__(self, enabled=False, bins=20):
+        self.enabled = enabled
+        self.bins = bins
+        self.durations = {}
+
+    def timer(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name, duration):
+        if not name in self.durations:
+            self.durations[name] = []
+        self.durations[name].append(duration)
+
+    def reset(self):
+        self.durations = {}
+
+    def summary(self):
+        """
+        Return statistics and histogram of durations (in seconds) of each section
+        """
+        summary = {}
+        for name, durations in self.durations.items():
+            durations = np.array(durations)
+            hist, bin_edges = np.histogram(durations, bins=self.bins)
+            summary[name] = {
+                "count": len(durations),
+                "total": float(durations.sum()),
+                "mean": float(durations.mean()),
+                "std": float(durations.std()),
+                "min": float(durations.min()),
+                "p50": float(np.percentile(durations, 50)),
+                "p90": float(np.percentile(durations, 90)),
+                "p99": float(np.percentile(durations, 99)),
+                "max": float(durations.max()),
+                "histogram": hist.tolist(),
+                "bin_edges": bin_edges.tolist()
+            }
+        return summary
+
+    def dump(self, log_dir, name):
+        """
+        Write the summary to <log_dir>/<name>.json, and the statistics without histograms to <log_dir>/<name>.csv
+        """
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        summary = self.summary()
+        with open(os.path.join(log_dir, name + ".json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        fields = ["section", "count", "total", "mean", "std", "min", "p50", "p90", "p99", "max"]
+        with open(os.path.join(log_dir, name + ".csv"), "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for section, stats in sorted(summary.items(), key=lambda x: -x[1]["total"]):
+                writer.writerow([section] + [stats[field] for field in fields[1:]])
+        return summary
@@ -0,0 +1,76 @@
+from benchmark import generate_grid, benchmark_world_construction, benchmark_world_step, benchmark_generators, benchmark_agent
+from benchmark.suite import AGENTS
+import argparse
+import os
+import json
+import platform
+import subprocess
+from datetime import datetime
+
+# parse args
+parser = argparse.ArgumentParser(description='Benchmark simulation and agent throughput on synthetic grids')
+parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, 8, 12, 16, 20], help='grid sizes n, each benchmarked on an n x n grid')
+parser.add_argument('--thread', type=int, default=1, help='number of threads')
+parser.add_argument('--steps', type=int, default=300, help='number of steps timed in each benchmark')
+parser.add_argument('--action_interval', type=int, default=20, help='how often agents make decisions')
+parser.add_argument('--agents', type=str, nargs='+', default=AGENTS, choices=AGENTS, help='agents to benchmark')
+parser.add_argument('--scenario_dir', type=str, default="benchmark/scenarios", help='directory in which grid scenarios are generated')
+parser.add_argument('--output', type=str, default=None, help='path of the json result file, defaults to log/benchmark/<time>.json')
+args = parser.parse_args()
+
+# info subscriptions timed with World.step
+STEP_INFOS = {
+    "none": [],
+    "lane_count": ["lane_count"],
+    "lane_stats": ["lane_count", "lane_waiting_count", "lane_vehicles"],
+    "trackers": ["lane_count", "lane_waiting_time_count", "vehicle_trajectory", "history_vehicles"]
+}
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+output = args.output
+if output is None:
+    output = os.path.join("log/benchmark", datetime.now().strftime('%Y%m%d-%H%M%S') + ".json")
+if os.path.dirname(output) and not os.path.exists(os.path.dirname(output)):
+    os.makedirs(os.path.dirname(output))
+
+results = {
+    "commit": get_commit(),
+    "time": datetime.now().isoformat(),
+    "python": platform.python_version(),
+    "args": vars(args),
+    "grids": []
+}
+
+for size in args.sizes:
+    print("benchmarking %dx%d grid..." % (size, size))
+    config_file = generate_grid(size, size, os.path.join(args.scenario_dir, "grid_%dx%d" % (size, size)))
+    result = {
+        "rows": size,
+        "cols": size,
+        "construction": benchmark_world_construction(config_file, args.thread),
+        "step": {name: benchmark_world_step(config_file, infos, args.steps, args.thread) for name, infos in STEP_INFOS.items()},
+        "generators": benchmark_generators(config_file, steps=args.steps, thread_num=args.thread),
+        "agents": {}
+    }
+    for name in args.agents:
+        result["agents"][name] = benchmark_agent(config_file, name, args.steps, args.action_interval, args.thread)
+    results["grids"].append(result)
+
+    # write after every grid, so that partial results survive an interrupted run
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+for result in results["grids"]:
+    print("%dx%d grid: construction %.3fs, %.1f steps/sec, %s" % (
+        result["rows"], result["cols"], result["construction"]["seconds"],
+        result["step"]["none"]["steps_per_sec"],
+        ", ".join("%s %.1f decisions/sec" % (name, r["decisions_per_sec"]) for name, r in result["agents"].items())))
+print("results written to %s" % output)
@@ -2,10 +2,13 @@ import gym
 from environment import TSCEnv
 from world import World
 from generator import LaneVehicleGenerator
-from agent.dqn_agent import DQNAgent
+from agent.dqn_agent import DQNAgent, DQNAgentGroup
 from metric import TravelTimeMetric
+from agent.async_learner import AsyncLearner
+from profiler import Profiler
 import argparse
 import os
+import threading
 import numpy as np
 import logging
 from datetime import datetime
@@ -17,11 +20,17 @@ parser.add_argument('--thread', type=int, default=1, help='number of threads')
 parser.add_argument('--steps', type=int, default=3600, help='number of steps')
 parser.add_argument('--action_interval', type=int, default=20, help='how often agent make decisions')
 parser.add_argument('--episodes', type=int, default=200, help='training episodes')
+parser.add_argument('--parameter_sharing', action="store_true", default=False, help='share one model between all agents')
 parser.add_argument('--save_model', action="store_true", default=False)
 parser.add_argument('--load_model', action="store_true", default=False)
 parser.add_argument("--save_rate", type=int, default=20, help="save model once every time this many episodes are completed")
 parser.add_argument('--save_dir', type=str, default="model/dqn", help='directory in which model should be saved')
 parser.add_argument('--log_dir', type=str, default="log/dqn", help='directory in which logs should be saved')
+parser.add_argument('--prioritized_replay', action="store_true", default=False, help='sample transitions by their TD errors, with importance-sampling weights')
+parser.add_argument('--async_learner', action="store_true", default=False, help='train models in a background thread while agents act')
+parser.add_argument('--sync_freq', type=int, default=10, help='decisions between two weight syncs of the acting models, with --async_learner')
+parser.add_argument('--max_lag', type=int, default=None, help='max number of decisions the async learner can fall behind, unbounded by default')
+parser.add_argument('--profile', action="store_true", default=False, help='record timing of each step and write it to log_dir every episode')
 args = parser.parse_args()
 
 if not os.path.exists(args.log_dir):
@@ -36,20 +45,42 @@ logger.addHandler(fh)
 logger.addHandler(sh)
 
 # create world
-world = World(args.config_file, thread_num=args.thread)
+world = World(args.config_file, thread_num=args.thread, profiler=Profiler(enabled=args.profile))
+profiler = world.profiler
 
 # create agents
 agents = []
-for i in world.intersections:
+# with --parameter_sharing, intersections of the same kind share the model and the memory of the first one
+ob_generators = [LaneVehicleGenerator(world, i, ["lane_count"], in_only=True, average=None) for i in world.intersections]
+keys = [(ob_generator.ob_length, len(i.phases)) for ob_generator, i in zip(ob_generators, world.intersections)]
+shared_agents = {}
+for i, ob_generator, key in zip(world.intersections, ob_generators, keys):
     action_space = gym.spaces.Discrete(len(i.phases))
+    shared_agent = shared_agents.get(key) if args.parameter_sharing else None
     agents.append(DQNAgent(
         action_space,
-        LaneVehicleGenerator(world, i, ["lane_count"], in_only=True, average=None),
+        ob_generator,
         LaneVehicleGenerator(world, i, ["lane_waiting_count"], in_only=True, average="all", negative=True),
-        i.id
+        i.id,
+        memory_size=2000 * keys.count(key) if args.parameter_sharing else 2000,
+        prioritized_replay=args.prioritized_replay,
+        shared_agent=shared_agent
     ))
-    if args.load_model:
-        agents[-1].load_model(args.save_dir)
+    if shared_agent is None:
+        shared_agents[key] = agents[-1]
+# agents training their model, one for each shared model
+learners = [agent for agent in agents if agent.shared_agent is None]
+if args.load_model:
+    for learner in learners:
+        learner.load_model(args.save_dir)
+
+# with --async_learner, a learner thread trains the models while agents act with periodically synced copies
+async_learner = AsyncLearner(learners, sync_freq=args.sync_freq, max_lag=args.max_lag) if args.async_learner else None
+# held while saving models, so that they are not trained meanwhile
+model_lock = async_learner.lock if async_learner is not None else threading.Lock()
+
+# select actions of all agents with one forward pass per kind of intersection
+agent_group = DQNAgentGroup(agents)
 
 # create metric
 metric = TravelTimeMetric(world)
@@ -60,6 +91,8 @@ env = TSCEnv(world, agents, metric)
 # train dqn_agent
 def train(args, env):
     total_decision_num = 0
+    if async_learner is not None:
+        async_learner.start()
     for e in range(args.episodes):
         last_obs = env.reset()
         if e % args.save_rate == args.save_rate - 1:
@@ -72,54 +105,56 @@ def train(args, env):
         i = 0
         while i < args.steps:
             if i % args.action_interval == 0:
-                actions = []
-                for agent_id, agent in enumerate(agents):
-                    if total_decision_num > agent.learning_start:
-                    #if True:
-                        actions.append(agent.get_action(last_obs[agent_id]))
-                    else:
-                        actions.append(agent.sample())
-
-                rewards_list = []
-                for _ in range(args.action_interval):
-                    obs, rewards, dones, _ = env.step(actions)
-                    i += 1
-                    rewards_list.append(rewards)
-                rewards = np.mean(rewards_list, axis=0)
+                if total_decision_num > agents[0].learning_start:
+                    with profiler.timer("agent.get_action"):
+                        actions = agent_group.get_actions(last_obs)
+                else:
+                    actions = [agent.sample() for agent in agents]
+
+                obs, rewards, dones, _ = env.step_interval(actions, args.action_interval)
+                i += args.action_interval
 
                 for agent_id, agent in enumerate(agents):
                     agent.remember(last_obs[agent_id], actions[agent_id], rewards[agent_id], obs[agent_id])
                     episodes_rewards[agent_id] += rewards[agent_id]
                     episodes_decision_num += 1
                     total_decision_num += 1
-                
+                if async_learner is not None:
+                    async_learner.notify(len(agents))
+
                 last_obs = obs
 
-            for agent_id, agent in enumerate(agents):
-                if total_decision_num > agent.learning_start and total_decision_num % agent.update_model_freq == agent.update_model_freq - 1:
-                    agent.replay()
-                if total_decision_num > agent.learning_start and total_decision_num % agent.update_target_model_freq == agent.update_target_model_freq - 1:
-                    agent.update_target_network()
+            if async_learner is None:
+                for learner in learners:
+                    if total_decision_num > learner.learning_start and total_decision_num % learner.update_model_freq == learner.update_model_freq - 1:
+                        with profiler.timer("agent.replay"):
+                            learner.replay()
+                    if total_decision_num > learner.learning_start and total_decision_num % learner.update_target_model_freq == learner.update_target_model_freq - 1:
+                        learner.update_target_network()
             if all(dones):
                 break
         if e % args.save_rate == args.save_rate - 1:
             if not os.path.exists(args.save_dir):
                 os.makedirs(args.save_dir)
-            for agent in agents:
-                agent.save_model(args.save_dir)
+            with model_lock:
+                for learner in learners:
+                    learner.save_model(args.save_dir)
         logger.info("episode:{}/{}, average travel time:{}".format(e, args.episodes, env.eng.get_average_travel_time()))
+        if args.profile:
+            profiler.dump(args.log_dir, "profile_episode_%d" % e)
+            profiler.reset()
         for agent_id, agent in enumerate(agents):
             logger.info("agent:{}, mean_episode_reward:{}".format(agent_id, episodes_rewards[agent_id] / episodes_decision_num))
+    if async_learner is not None:
+        async_learner.stop()
 
 def test():
     obs = env.reset()
-    for agent in agents:
-        agent.load_model(args.save_dir)
+    for learner in learners:
+        learner.load_model(args.save_dir)
     for i in range(args.steps):
         if i % args.action_interval == 0:
-            actions = []
-            for agent_id, agent in enumerate(agents):
-                actions.append(agent.get_action(obs[agent_id]))
+            actions = agent_group.get_actions(obs)
         obs, rewards, dones, info = env.step(actions)
         #print(rewards)
 
@@ -5,6 +5,8 @@ from generator import LaneVehicleGenerator
 from generator import IntersectionVehicleGenerator
 from agent.intellilight_agent import IntelliLightAgent, paras
 from metric import TravelTimeMetric
+from log_sink import LogSink
+from profiler import Profiler
 import argparse
 import os
 import json
@@ -31,11 +33,20 @@ def parse_arguments():
     parser.add_argument('--thread', type=int, default=1, help='number of threads')
     parser.add_argument('--steps', type=int, default=3600, help='number of steps')
     parser.add_argument("-s", "--silent", action="store_true")
+    parser.add_argument('--skip_init_model', action="store_true", default=False, help='do not save the untrained model as init_model')
+    parser.add_argument('--log_dir', type=str, default=paras["PATH_TO_OUTPUT"], help='directory in which logs should be saved')
+    parser.add_argument('--log_verbosity', type=int, default=2,
+                        help='0: no logs, 1: memories of each decision, 2: also samples of each training')
+    parser.add_argument('--profile', action="store_true", default=False, help='record timing of each step and write it to log_dir every episode')
     return parser.parse_args()
 args = parse_arguments()
 
 # create world
-world = World(args.config_file, thread_num=args.thread)
+world = World(args.config_file, thread_num=args.thread, profiler=Profiler(enabled=args.profile))
+profiler = world.profiler
+
+# records are written to log_dir by a background thread
+log_sink = LogSink(args.log_dir, verbosity=args.log_verbosity)
 
 # create agents
 agents = []
@@ -55,7 +66,9 @@ for idx, i in enumerate(world.intersections):
             IntersectionVehicleGenerator(world, i, targets=["passed_count", "passed_time_count"])
         ],
         world,
-        idx
+        idx,
+        log_sink=log_sink,
+        save_init_model=not args.skip_init_model
     ))
 
 # create metric
@@ -71,6 +84,13 @@ class TrafficLightDQN:
         self.env = env
         self.world = world
         self.yellow_time = self.world.intersections[0].yellow_phase_time
+        self.profile_episodes = 0
+
+    def _dump_profile(self):
+        if args.profile:
+            profiler.dump(args.log_dir, "profile_episode_%d" % self.profile_episodes)
+            profiler.reset()
+            self.profile_episodes += 1
 
     def _generate_pre_train_ratios(self, phase_min_time, em_phase):
         phase_traffic_ratios = [phase_min_time]
@@ -116,11 +136,6 @@ class TrafficLightDQN:
         else:
             total_run_cnt = paras["RUN_COUNTS"]
 
-        # initialize output streams
-        if not os.path.exists(paras["PATH_TO_OUTPUT"]):
-            os.makedirs(paras["PATH_TO_OUTPUT"])
-        file_name_memory = os.path.join(paras["PATH_TO_OUTPUT"], "memories.txt")
-
         num_step = args.steps
 
         current_time = 0  # in seconds
@@ -134,6 +149,7 @@ class TrafficLightDQN:
         while total_steps < total_run_cnt:
             total_steps += 1
             if current_time >= 3600:
+                self._dump_profile()
                 obs = env.reset()
                 ob = obs[0]
                 last_action = 0
@@ -141,6 +157,7 @@ class TrafficLightDQN:
             if if_pretrain:
                 if current_time > pre_train_count_per_ratio:
                     print("Terminal occured. Episode end.")
+                    self._dump_profile()
                     self.env.reset()
                     ind_phase_time += 1
                     if ind_phase_time >= len(phase_traffic_ratios):
@@ -150,10 +167,9 @@ class TrafficLightDQN:
 
                 phase_time_now = phase_traffic_ratios[ind_phase_time]
 
-            f_memory = open(file_name_memory, "a")
-
             if if_pretrain:
-                _, q_values = self.agent.choose(state=ob, count=current_time, if_pretrain=if_pretrain)
+                with profiler.timer("agent.get_action"):
+                    _, q_values = self.agent.choose(state=ob, count=current_time, if_pretrain=if_pretrain)
                 if ob.time_this_phase[0][0] < phase_time_now[ob.cur_phase[0][0]]:
                     action_pred = 0
                 else:
@@ -163,7 +179,8 @@ class TrafficLightDQN:
                 action = self.agent.next_phase(last_action) if action_pred else last_action
             else:
                 # get action based on e-greedy, combine current state
-                action, q_values = self.agent.choose(state=ob, count=current_time, if_pretrain=if_pretrain)
+                with profiler.timer("agent.get_action"):
+                    action, q_values = self.agent.choose(state=ob, count=current_time, if_pretrain=if_pretrain)
 
             next_obs, rewards, dones, info = env.step([action])
             if not action == last_action:
@@ -178,20 +195,17 @@ class TrafficLightDQN:
             # remember
             self.agent.remember(ob, 1 - (action==last_action), reward, next_ob)
 
-            # output to std out and file
-            memory_str = 'time = %d\taction = %d\tcurrent_phase = %d\tnext_phase = %d\treward = %f' \
-                         '\t%s' \
-                         % (current_time, action,
-                            ob.cur_phase[0][0],
-                            ob.next_phase[0][0],
-                            reward, repr(q_values))
-            print(memory_str)
-            f_memory.write(memory_str + "\n")
-            f_memory.close()
+            # output to std out and log
+            if not args.silent:
+                print('time = %d\taction = %d\tcurrent_phase = %d\tnext_phase = %d\treward = %f\t%s'
+                      % (current_time, action, ob.cur_phase[0][0], ob.next_phase[0][0], reward, repr(q_values)))
+            log_sink.log("memories", {"time": current_time, "action": action, "current_phase": ob.cur_phase[0][0],
+                                      "next_phase": ob.next_phase[0][0], "reward": reward, "q_values": q_values})
 
             if not if_pretrain:
                 # update network
-                self.agent.update_network(if_pretrain, use_average, total_steps)
+                with profiler.timer("agent.replay"):
+                    self.agent.update_network(if_pretrain, use_average, total_steps)
                 self.agent.update_network_bar()
 
             last_action = action
@@ -200,8 +214,10 @@ class TrafficLightDQN:
 
         if if_pretrain:
             self.agent.set_update_outdated()
-            self.agent.update_network(if_pretrain, use_average, total_steps)
+            with profiler.timer("agent.replay"):
+                self.agent.update_network(if_pretrain, use_average, total_steps)
             self.agent.update_network_bar()
+        self._dump_profile()
         self.agent.reset_update_count()
         print("END")
 
@@ -235,6 +251,7 @@ if __name__ == "__main__":
     player = TrafficLightDQN(agents, env)
     player.train(if_pretrain=True, use_average=True)
     player.train(if_pretrain=False, use_average=False)
+    log_sink.close()
 
     # test(env, args, "602.0")
     # test(env, args, "init_model")
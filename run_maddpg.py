@@ -4,6 +4,7 @@ from world import World
 from generator import LaneVehicleGenerator
 from agent.maddpg_agent import MADDPGAgent
 from metric import TravelTimeMetric
+from profiler import Profiler
 import argparse
 import tensorflow as tf
 import os
@@ -27,11 +28,14 @@ def parse_args():
     # Checkpointing
     parser.add_argument("--save-dir", type=str, default="model/maddpg/", help="directory in which model should be saved")
     parser.add_argument("--save-rate", type=int, default=3, help="save model once every time this many episodes are completed")
+    parser.add_argument('--log_dir', type=str, default="log/maddpg", help='directory in which logs should be saved')
+    parser.add_argument('--profile', action="store_true", default=False, help='record timing of each step and write it to log_dir every episode')
     return parser.parse_args()
 args = parse_args()
 
 # create world
-world = World(args.config_file, thread_num=args.thread)
+world = World(args.config_file, thread_num=args.thread, profiler=Profiler(enabled=args.profile))
+profiler = world.profiler
 
 # create agents
 agents = []
@@ -114,13 +118,16 @@ def train():
             episode_rewards = [0.0]  # sum of rewards for all agents
             agent_rewards = [[0.0] for _ in range(env.n)]  # individual agent reward
             obs_n = env.reset()
+            # timings of pretraining and evaluation are not part of the episode
+            profiler.reset()
             episode_step = 0
             step = 0
             while step < args.steps:
                 if step % args.action_interval == 0:
                     # get action
-                    action_n = [agent.get_action(obs, exploration=True) for agent, obs in zip(agents, obs_n)]
-                    action_prob_n = [agent.get_action_prob(obs) for agent, obs in zip(agents, obs_n)]
+                    with profiler.timer("agent.get_action"):
+                        action_n = [agent.get_action(obs, exploration=True) for agent, obs in zip(agents, obs_n)]
+                        action_prob_n = [agent.get_action_prob(obs) for agent, obs in zip(agents, obs_n)]
                     # environment step
                     for _ in range(args.action_interval):
                         new_obs_n, rew_n, done_n, info_n = env.step(action_n)
@@ -142,12 +149,15 @@ def train():
                     # update all trainers, if not in display or benchmark mode
                     loss = None
                     for agent in agents:
-                        loss = agent.update(agents, train_step)
+                        with profiler.timer("agent.replay"):
+                            loss = agent.update(agents, train_step)
                         # print(loss)
                         # if loss is not None:
                         #     print(loss[0], loss[1])
 
             print("episode:{}/{}, total agent episode mean reward:{}".format(e, args.episodes, episode_rewards[0]/episode_step))
+            if args.profile:
+                profiler.dump(args.log_dir, "profile_episode_%d" % e)
             # for i in range(len(agents)):
             #     print("agent:{}, episode mean reward:{}".format(i, agent_rewards[i][-1]/episode_step))
             if e % args.save_rate == 0:
@@ -2,10 +2,13 @@ import gym
 from environment import TSCEnv
 from world import World
 from generator import LaneVehicleGenerator
-from agent.presslight_agent import PressLightAgent
+from agent.presslight_agent import PressLightAgent, SharedPressLightAgent
 from metric import TravelTimeMetric
+from agent.async_learner import AsyncLearner
+from profiler import Profiler
 import argparse
 import os
+import threading
 import numpy as np
 import logging
 from datetime import datetime
@@ -23,6 +26,11 @@ parser.add_argument("--save_rate", type=int, default=20,
                     help="save model once every time this many episodes are completed")
 parser.add_argument('--save_dir', type=str, default="model/presslight", help='directory in which model should be saved')
 parser.add_argument('--log_dir', type=str, default="log/presslight", help='directory in which logs should be saved')
+parser.add_argument('--shared', action="store_true", default=False, help='one model with shared parameters for all intersections')
+parser.add_argument('--async_learner', action="store_true", default=False, help='train models in a background thread while agents act')
+parser.add_argument('--sync_freq', type=int, default=10, help='decisions between two weight syncs of the acting models, with --async_learner')
+parser.add_argument('--max_lag', type=int, default=None, help='max number of decisions the async learner can fall behind, unbounded by default')
+parser.add_argument('--profile', action="store_true", default=False, help='record timing of each step and write it to log_dir every episode')
 args = parser.parse_args()
 
 if not os.path.exists(args.log_dir):
@@ -37,7 +45,8 @@ logger.addHandler(fh)
 logger.addHandler(sh)
 
 # create world
-world = World(args.config_file, thread_num=args.thread)
+world = World(args.config_file, thread_num=args.thread, profiler=Profiler(enabled=args.profile))
+profiler = world.profiler
 
 # create agents
 agents = []
@@ -48,10 +57,19 @@ for i in world.intersections:
         LaneVehicleGenerator(world, i, ["lane_count"], in_only=True, average=None),
         LaneVehicleGenerator(world, i, ["lane_waiting_count"], in_only=True, average="all", negative=True),
         i.id,
-        world
+        world,
+        shared=args.shared
     ))
-    if args.load_model:
-        agents[-1].load_model(args.save_dir)
+# with --shared, one SharedPressLightAgent learns and acts for all agents
+shared_agent = SharedPressLightAgent(agents) if args.shared else None
+learners = [shared_agent] if args.shared else agents
+if args.load_model:
+    for learner in learners:
+        learner.load_model(args.save_dir)
+# with --async_learner, a learner thread trains the models while agents act with periodically synced copies
+async_learner = AsyncLearner(learners, sync_freq=args.sync_freq, max_lag=args.max_lag) if args.async_learner else None
+# held while saving models, so that they are not trained meanwhile
+model_lock = async_learner.lock if async_learner is not None else threading.Lock()
 print(agents[0].ob_length)
 print(agents[0].action_space)
 
@@ -62,9 +80,27 @@ metric = TravelTimeMetric(world)
 env = TSCEnv(world, agents, metric)
 
 
+def get_actions(phases, obs):
+    if shared_agent is not None:
+        return shared_agent.get_actions(phases, obs)
+    return [agent.get_action(phases[agent_id], obs[agent_id]) for agent_id, agent in enumerate(agents)]
+
+
+def remember(last_obs, last_phase, actions, rewards, obs, phase):
+    for agent_id, agent in enumerate(agents):
+        if shared_agent is not None:
+            shared_agent.remember(agent_id, last_obs[agent_id], last_phase[agent_id], actions[agent_id], rewards[agent_id],
+                                  obs[agent_id], phase[agent_id])
+        else:
+            agent.remember(last_obs[agent_id], last_phase[agent_id], actions[agent_id], rewards[agent_id],
+                           obs[agent_id], phase[agent_id])
+
+
 # train presslight_agent
 def train(args, env):
     total_decision_num = 0
+    if async_learner is not None:
+        async_learner.start()
     for e in range(args.episodes):
         last_obs = env.reset()
         if e % args.save_rate == args.save_rate - 1:
@@ -77,67 +113,62 @@ def train(args, env):
         i = 0
         while i < args.steps:
             if i % args.action_interval == 0:
-                actions = []
-                last_phase = []
-                for agent_id, agent in enumerate(agents):
-                    last_phase.append([env.world.intersections[agent_id].current_phase])
-                    if total_decision_num > agent.learning_start:
-                        # if True:
-                        actions.append(
-                            agent.get_action([env.world.intersections[agent_id].current_phase], last_obs[agent_id]))
-                    else:
-                        actions.append(agent.sample())
-
-                rewards_list = []
-                for _ in range(args.action_interval):
-                    obs, rewards, dones, _ = env.step(actions)
-                    i += 1
-                    rewards_list.append(rewards)
-                rewards = np.mean(rewards_list, axis=0)
-
+                last_phase = [[intersection.current_phase] for intersection in env.world.intersections]
+                if total_decision_num > learners[0].learning_start:
+                    with profiler.timer("agent.get_action"):
+                        actions = get_actions(last_phase, last_obs)
+                else:
+                    actions = [agent.sample() for agent in agents]
+
+                obs, rewards, dones, _ = env.step_interval(actions, args.action_interval)
+                i += args.action_interval
+
+                remember(last_obs, last_phase, actions, rewards, obs,
+                         [[intersection.current_phase] for intersection in env.world.intersections])
                 for agent_id, agent in enumerate(agents):
-                    agent.remember(last_obs[agent_id], last_phase[agent_id], actions[agent_id], rewards[agent_id],
-                                   obs[agent_id],
-                                   [env.world.intersections[agent_id].current_phase])
                     episodes_rewards[agent_id] += rewards[agent_id]
                     episodes_decision_num += 1
                     total_decision_num += 1
+                if async_learner is not None:
+                    async_learner.notify(len(agents))
 
                 last_obs = obs
 
-            for agent_id, agent in enumerate(agents):
-                if total_decision_num > agent.learning_start and total_decision_num % agent.update_model_freq == agent.update_model_freq - 1:
-                    agent.replay()
-                if total_decision_num > agent.learning_start and total_decision_num % agent.update_target_model_freq == agent.update_target_model_freq - 1:
-                    agent.update_target_network()
+            if async_learner is None:
+                for learner in learners:
+                    if total_decision_num > learner.learning_start and total_decision_num % learner.update_model_freq == learner.update_model_freq - 1:
+                        with profiler.timer("agent.replay"):
+                            learner.replay()
+                    if total_decision_num > learner.learning_start and total_decision_num % learner.update_target_model_freq == learner.update_target_model_freq - 1:
+                        learner.update_target_network()
             if all(dones):
                 break
         if e % args.save_rate == args.save_rate - 1:
             if not os.path.exists(args.save_dir):
                 os.makedirs(args.save_dir)
-            for agent in agents:
-                agent.save_model(args.save_dir)
+            with model_lock:
+                for learner in learners:
+                    learner.save_model(args.save_dir)
         logger.info("episode:{}/{}, average travel time:{}".format(e, args.episodes, env.eng.get_average_travel_time()))
+        if args.profile:
+            profiler.dump(args.log_dir, "profile_episode_%d" % e)
+            profiler.reset()
         for agent_id, agent in enumerate(agents):
             logger.info(
                 "agent:{}, mean_episode_reward:{}".format(agent_id, episodes_rewards[agent_id] / episodes_decision_num))
+    if async_learner is not None:
+        async_learner.stop()
 
 
 def test():
     obs = env.reset()
-    for agent in agents:
-        agent.load_model(args.save_dir)
+    for learner in learners:
+        learner.load_model(args.save_dir)
     for i in range(args.steps):
         if i % args.action_interval == 0:
-            actions = []
-            for agent_id, agent in enumerate(agents):
-                actions.append(agent.get_action([env.world.intersections[agent_id].current_phase], obs[agent_id]))
-            rewards_list = []
-            for _ in range(args.action_interval):
-                obs, rewards, dones, _ = env.step(actions)
-                i += 1
-                rewards_list.append(rewards)
-            rewards = np.mean(rewards_list, axis=0)
+            actions = get_actions([[intersection.current_phase] for intersection in env.world.intersections], obs)
+            obs, rewards, dones, _ = env.step_interval(actions, args.action_interval)
+            i += args.action_interval
         # print(env.eng.get_average_travel_time())
         if all(dones):
             break
@@ -148,33 +179,24 @@ def meta_test(config):
     obs = env.reset()
     last_obs = obs
     # env.change_world(World(config, thread_num=args.thread))
-    for agent in agents:
-        agent.load_model(args.save_dir)
+    for learner in learners:
+        learner.load_model(args.save_dir)
     total_decision_num = 0
     for i in range(args.steps):
         if i % args.action_interval == 0:
-            actions = []
-            last_phase = []
-            for agent_id, agent in enumerate(agents):
-                last_phase.append([env.world.intersections[agent_id].current_phase])
-                actions.append(agent.get_action([env.world.intersections[agent_id].current_phase], obs[agent_id]))
-            rewards_list = []
-            for _ in range(args.action_interval):
-                obs, rewards, dones, _ = env.step(actions)
-                i += 1
-                rewards_list.append(rewards)
-            rewards = np.mean(rewards_list, axis=0)
-            for agent_id, agent in enumerate(agents):
-                agent.remember(last_obs[agent_id], last_phase[agent_id], actions[agent_id], rewards[agent_id],
-                               obs[agent_id],
-                               [env.world.intersections[agent_id].current_phase])
-                total_decision_num += 1
+            last_phase = [[intersection.current_phase] for intersection in env.world.intersections]
+            actions = get_actions(last_phase, obs)
+            obs, rewards, dones, _ = env.step_interval(actions, args.action_interval)
+            i += args.action_interval
+            remember(last_obs, last_phase, actions, rewards, obs,
+                     [[intersection.current_phase] for intersection in env.world.intersections])
+            total_decision_num += len(agents)
             last_obs = obs
-        for agent_id, agent in enumerate(agents):
-            if total_decision_num % agent.update_model_freq == agent.update_model_freq - 1:
-                agent.replay()
-            if total_decision_num % agent.update_target_model_freq == agent.update_target_model_freq - 1:
-                agent.update_target_network()
+        for learner in learners:
+            if total_decision_num % learner.update_model_freq == learner.update_model_freq - 1:
+                learner.replay()
+            if total_decision_num % learner.update_target_model_freq == learner.update_target_model_freq - 1:
+                learner.update_target_network()
         # print(env.eng.get_average_travel_time())
         if all(dones):
             break
@@ -4,6 +4,7 @@ from world import World
 from generator import LaneVehicleGenerator
 from agent import SOTLAgent
 from metric import TravelTimeMetric
+from profiler import Profiler
 import argparse
 
 # parse args
@@ -12,10 +13,13 @@ parser.add_argument('config_file', type=str, help='path of config file')
 parser.add_argument('--thread', type=int, default=1, help='number of threads')
 parser.add_argument('--steps', type=int, default=100, help='number of steps')
 parser.add_argument('--delta_t', type=int, default=1, help='how often agent make decisions')
+parser.add_argument('--log_dir', type=str, default="log/sotl", help='directory in which logs should be saved')
+parser.add_argument('--profile', action="store_true", default=False, help='record timing of each step and write it to log_dir')
 args = parser.parse_args()
 
 # create world
-world = World(args.config_file, thread_num=args.thread)
+world = World(args.config_file, thread_num=args.thread, profiler=Profiler(enabled=args.profile))
+profiler = world.profiler
 
 # create agents
 agents = []
@@ -35,7 +39,8 @@ actions = []
 for i in range(args.steps):
     actions = []
     for agent_id, agent in enumerate(agents):
-        actions.append(agent.get_action(obs[agent_id]))
+        with profiler.timer("agent.get_action"):
+            actions.append(agent.get_action(obs[agent_id]))
     obs, rewards, dones, info = env.step(actions)
     print(world.intersections[0]._current_phase, end=",")
     print(env.eng.get_average_travel_time())
@@ -43,4 +48,7 @@ for i in range(args.steps):
     #print(rewards)
     # print(info["metric"])
 
-#print("Final Travel Time is %.4f" % env.metric.update(done=True))
\ No newline at end of file
+#print("Final Travel Time is %.4f" % env.metric.update(done=True))
+
+if args.profile:
+    profiler.dump(args.log_dir, "profile_episode_0")
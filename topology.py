@@ -0,0 +1,220 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from math import atan2, pi
+
+# bump whenever the arrays below change, so that stale caches are not loaded
+TOPOLOGY_VERSION = 1
+
+
+def _get_direction(points, out=True):
+    if out:
+        x = points[1][0] - points[0][0]
+        y = points[1][1] - points[0][1]
+    else:
+        x = points[-2][0] - points[-1][0]
+        y = points[-2][1] - points[-1][1]
+    tmp = atan2(x, y)
+    return tmp if tmp >= 0 else (tmp + 2 * pi)
+
+
+def _csr_indptr(lengths):
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(lengths)
+    return indptr
+
+
+class Topology(object):
+    """
+    Roadnet topology compiled into flat arrays: roads, lanes, intersections, roadlinks, lanelinks and phases
+    are referred to by integer indices, and variable length relations are stored as CSR (indptr, values) pairs.
+
+    Compiling parses the roadnet json once, load_topology() caches the arrays on disk
+    and memory-maps them on subsequent starts.
+
+    Parameters
+    ----------
+    arrays : dict of array name to numpy array, see compile() for the arrays
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    @classmethod
+    def compile(cls, roadnet):
+        """
+        Compile a parsed roadnet json into a Topology
+
+        Arrays:
+            road_ids, road_start_intersection, road_end_intersection, road_lane_start, road_num_lanes, road_length
+            road_point_indptr, road_points : points of each road
+            lane_ids, lane_road
+            intersection_ids, intersection_virtual, intersection_points
+            intersection_road_indptr, intersection_roads, intersection_road_out, intersection_road_direction :
+                roads of each intersection, clock-wise order from North, incoming roads first on ties
+            intersection_roadlink_indptr, roadlink_start_road, roadlink_end_road : roadlinks of each intersection
+            roadlink_lanelink_indptr, lanelink_start_lane, lanelink_end_lane : lanelinks of each roadlink
+            intersection_phase_indptr, phase_roadlink_indptr, phase_roadlinks :
+                light phases of each intersection, and their available roadlinks (indices local to the intersection)
+        """
+        intersection_ids = [i["id"] for i in roadnet["intersections"]]
+        intersection_index = {iid: idx for idx, iid in enumerate(intersection_ids)}
+
+        # roads and lanes
+        road_ids = [road["id"] for road in roadnet["roads"]]
+        road_index = {rid: idx for idx, rid in enumerate(road_ids)}
+        road_num_lanes = np.array([len(road["lanes"]) for road in roadnet["roads"]], dtype=np.int64)
+        road_lane_start = _csr_indptr(road_num_lanes)[:-1]
+        road_points = [[(point["x"], point["y"]) for point in road["points"]] for road in roadnet["roads"]]
+        road_length = np.array([np.linalg.norm(np.diff(np.array(points, dtype=np.float64), axis=0), axis=1).sum()
+                                for points in road_points], dtype=np.float64)
+        lane_ids = [rid + "_" + str(i) for rid, n in zip(road_ids, road_num_lanes) for i in range(n)]
+
+        # roads of each intersection, sorted clock-wise from North
+        intersection_roads = [[] for _ in intersection_ids]
+        for ridx, road in enumerate(roadnet["roads"]):
+            for out, iid in ((True, road["startIntersection"]), (False, road["endIntersection"])):
+                if iid in intersection_index:
+                    intersection_roads[intersection_index[iid]].append(
+                        (ridx, out, _get_direction(road_points[ridx], out)))
+        # vehicles moves on the right side, currently always true due to CityFlow's mechanism
+        intersection_roads = [sorted(roads, key=lambda x: (x[2], x[1])) for roads in intersection_roads]
+
+        # roadlinks, lanelinks and phases
+        roadlink_start_road, roadlink_end_road = [], []
+        roadlinks_per_intersection, lanelinks_per_roadlink = [], []
+        lanelink_start_lane, lanelink_end_lane = [], []
+        phases_per_intersection, roadlinks_per_phase, phase_roadlinks = [], [], []
+        for intersection in roadnet["intersections"]:
+            roadlinks_per_intersection.append(len(intersection["roadLinks"]))
+            for roadlink in intersection["roadLinks"]:
+                start_road, end_road = road_index[roadlink["startRoad"]], road_index[roadlink["endRoad"]]
+                roadlink_start_road.append(start_road)
+                roadlink_end_road.append(end_road)
+                lanelinks_per_roadlink.append(len(roadlink["laneLinks"]))
+                for lanelink in roadlink["laneLinks"]:
+                    lanelink_start_lane.append(road_lane_start[start_road] + lanelink["startLaneIndex"])
+                    lanelink_end_lane.append(road_lane_start[end_road] + lanelink["endLaneIndex"])
+            # virtual intersections may have no traffic light
+            phases = intersection.get("trafficLight", {}).get("lightphases", [])
+            phases_per_intersection.append(len(phases))
+            for phase in phases:
+                roadlinks_per_phase.append(len(phase["availableRoadLinks"]))
+                phase_roadlinks.extend(phase["availableRoadLinks"])
+
+        arrays = {
+            "version": np.array(TOPOLOGY_VERSION, dtype=np.int64),
+            "road_ids": np.array(road_ids, dtype=np.str_),
+            "road_start_intersection": np.array([intersection_index.get(road["startIntersection"], -1)
+                                                 for road in roadnet["roads"]], dtype=np.int64),
+            "road_end_intersection": np.array([intersection_index.get(road["endIntersection"], -1)
+                                               for road in roadnet["roads"]], dtype=np.int64),
+            "road_lane_start": road_lane_start,
+            "road_num_lanes": road_num_lanes,
+            "road_length": road_length,
+            "road_point_indptr": _csr_indptr([len(points) for points in road_points]),
+            "road_points": np.array([point for points in road_points for point in points], dtype=np.float64).reshape(-1, 2),
+            "lane_ids": np.array(lane_ids, dtype=np.str_),
+            "lane_road": np.repeat(np.arange(len(road_ids), dtype=np.int64), road_num_lanes),
+            "intersection_ids": np.array(intersection_ids, dtype=np.str_),
+            "intersection_virtual": np.array([i["virtual"] for i in roadnet["intersections"]], dtype=np.bool_),
+            "intersection_points": np.array([(i["point"]["x"], i["point"]["y"]) for i in roadnet["intersections"]],
+                                            dtype=np.float64).reshape(-1, 2),
+            "intersection_road_indptr": _csr_indptr([len(roads) for roads in intersection_roads]),
+            "intersection_roads": np.array([r[0] for roads in intersection_roads for r in roads], dtype=np.int64),
+            "intersection_road_out": np.array([r[1] for roads in intersection_roads for r in roads], dtype=np.bool_),
+            "intersection_road_direction": np.array([r[2] for roads in intersection_roads for r in roads], dtype=np.float64),
+            "intersection_roadlink_indptr": _csr_indptr(roadlinks_per_intersection),
+            "roadlink_start_road": np.array(roadlink_start_road, dtype=np.int64),
+            "roadlink_end_road": np.array(roadlink_end_road, dtype=np.int64),
+            "roadlink_lanelink_indptr": _csr_indptr(lanelinks_per_roadlink),
+            "lanelink_start_lane": np.array(lanelink_start_lane, dtype=np.int64),
+            "lanelink_end_lane": np.array(lanelink_end_lane, dtype=np.int64),
+            "intersection_phase_indptr": _csr_indptr(phases_per_intersection),
+            "phase_roadlink_indptr": _csr_indptr(roadlinks_per_phase),
+            "phase_roadlinks": np.array(phase_roadlinks, dtype=np.int64)
+        }
+        return cls(arrays)
+
+    def save(self, path):
+        """
+        Save the arrays as .npy files in directory path
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(path, name + ".npy"), array)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Load arrays saved by save(), memory-mapped by default
+        """
+        arrays = {}
+        for filename in os.listdir(path):
+            if filename.endswith(".npy"):
+                array = np.load(os.path.join(path, filename), mmap_mode=mmap_mode)
+                # plain ndarray views of the mapped buffers, as slicing np.memmap objects is slow
+                arrays[filename[:-len(".npy")]] = array.view(np.ndarray)
+        if not "version" in arrays or int(arrays["version"]) != TOPOLOGY_VERSION:
+            raise Exception("topology in %s is not of version %d" % (path, TOPOLOGY_VERSION))
+        return cls(arrays)
+
+    def roads_lane_indices(self, roads):
+        """
+        Return indices of the lanes of all roads in roads, concatenated
+        """
+        starts = self.road_lane_start[roads]
+        counts = self.road_num_lanes[roads]
+        offsets = np.arange(counts.sum(), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(starts, counts) + offsets
+
+    def road_lane_indices(self, road, reverse=False):
+        """
+        Return indices of the lanes of road, in reversed lane order if reverse
+        """
+        start = self.road_lane_start[road]
+        lanes = np.arange(start, start + self.road_num_lanes[road], dtype=np.int64)
+        return lanes[::-1] if reverse else lanes
+
+
+def _file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def load_topology(roadnet_file, cache_dir=None):
+    """
+    Return the Topology of a roadnet file. With cache_dir, the compiled topology is cached in
+    cache_dir/<hash of the roadnet file>/ and memory-mapped on later calls instead of parsing the roadnet again.
+
+    Parameters
+    ----------
+    roadnet_file : path of CityFlow roadnet file
+    cache_dir : None or directory of compiled topologies
+    """
+    if cache_dir is None:
+        with open(roadnet_file) as f:
+            return Topology.compile(json.load(f))
+
+    path = os.path.join(cache_dir, "%s_v%d" % (_file_hash(roadnet_file), TOPOLOGY_VERSION))
+    if os.path.exists(path):
+        return Topology.load(path)
+
+    with open(roadnet_file) as f:
+        topology = Topology.compile(json.load(f))
+    # save into a temporary directory first, so that concurrent runs never load a partially written cache
+    tmp_path = "%s.tmp%d" % (path, os.getpid())
+    topology.save(tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another run cached the same roadnet meanwhile
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return Topology.load(path)
@@ -0,0 +1,180 @@
+import copy
+from collections import OrderedDict, deque
+
+
+class VehicleTracker(object):
+    """
+    Track statistics of vehicles across simulation steps, with explicit vehicle lifecycle.
+
+    Vehicles entering and leaving the roadnet are detected at each step. Records of a departed vehicle are kept
+    for `retention` seconds after it left (trajectories are still needed shortly after a vehicle left, e.g. to
+    count vehicles passing an intersection), then evicted, so memory stays proportional to in-network vehicles.
+
+    While tracking trajectories, each time a vehicle leaves an incoming lane of an intersection, a record
+    (time, vehicle_id, time spent on the lane) is appended to a time-ordered buffer of that intersection,
+    records older than `retention` seconds are dropped.
+
+    Parameters
+    ----------
+    world : World object
+    retention : seconds to keep the records of departed vehicles
+    """
+    tracker_names = ("vehicle_waiting_time", "vehicle_trajectory", "history_vehicles")
+
+    def __init__(self, world, retention=300):
+        self.world = world
+        self.eng = world.eng
+        self.retention = retention
+
+        self.tracker_functions = {
+            "vehicle_waiting_time": self._update_vehicle_waiting_time,
+            "vehicle_trajectory": self._update_vehicle_trajectory,
+            "history_vehicles": self._update_history_vehicles
+        }
+        self.enabled = []
+
+        self.vehicle_waiting_time = {} # key: vehicle_id, value: the waiting time of this vehicle since last halt.
+        self.vehicle_trajectory = {} # key: vehicle_id, value: [[lane_id_1, enter_time, time_spent_on_lane_1], ... , [lane_id_n, enter_time, time_spent_on_lane_n]]
+        self.history_vehicles = set() # vehicles in the roadnet, and vehicles departed within retention
+
+        self.active_vehicles = set()
+        self.departed_vehicles = OrderedDict() # key: vehicle_id, value: departure time, in order of departure
+
+        # intersection of each incoming lane, and vehicles passed each intersection
+        self.lane_intersection = {}
+        for row, iid in enumerate(world.intersection_ids):
+            matrix = world.in_lane_matrix
+            for idx in matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]:
+                self.lane_intersection[world.all_lanes[idx]] = iid
+        self.passed_vehicles = {iid: deque() for iid in world.intersection_ids} # key: intersection_id, value: deque of (time, vehicle_id, time_spent_on_lane)
+        self.vehicles_on_lane = set() # vehicles whose last lane in trajectory is not left yet
+
+    def enable(self, tracker):
+        if not tracker in self.tracker_functions:
+            raise Exception("tracker %s not exists" % tracker)
+        if not tracker in self.enabled:
+            self.enabled.append(tracker)
+
+    def update(self):
+        if not self.enabled:
+            return
+        self.vehicles = self.world.query("vehicles")
+        self.current_time = self.world.query("current_time")
+        self._update_lifecycle()
+        for tracker in self.enabled:
+            self.tracker_functions[tracker]()
+
+    def _update_lifecycle(self):
+        vehicles = set(self.vehicles)
+        for vehicle in self.active_vehicles - vehicles:
+            self.departed_vehicles[vehicle] = self.current_time
+            self.on_vehicle_departed(vehicle)
+        self.active_vehicles = vehicles
+
+        while self.departed_vehicles:
+            vehicle, departure_time = next(iter(self.departed_vehicles.items()))
+            if self.current_time - departure_time < self.retention:
+                break
+            del self.departed_vehicles[vehicle]
+            self.evict(vehicle)
+
+    def on_vehicle_departed(self, vehicle):
+        # waiting time is only used for vehicles in the roadnet
+        self.vehicle_waiting_time.pop(vehicle, None)
+        if vehicle in self.vehicles_on_lane:
+            self._leave_lane(vehicle)
+
+    def evict(self, vehicle):
+        self.vehicle_trajectory.pop(vehicle, None)
+        self.history_vehicles.discard(vehicle)
+
+    def clear(self):
+        self.vehicle_waiting_time.clear()
+        self.vehicle_trajectory.clear()
+        self.history_vehicles.clear()
+        self.active_vehicles.clear()
+        self.departed_vehicles.clear()
+        for passed in self.passed_vehicles.values():
+            passed.clear()
+        self.vehicles_on_lane.clear()
+
+    def get_state(self):
+        return copy.deepcopy({
+            "vehicle_waiting_time": self.vehicle_waiting_time,
+            "vehicle_trajectory": self.vehicle_trajectory,
+            "history_vehicles": self.history_vehicles,
+            "active_vehicles": self.active_vehicles,
+            "departed_vehicles": self.departed_vehicles,
+            "passed_vehicles": self.passed_vehicles,
+            "vehicles_on_lane": self.vehicles_on_lane
+        })
+
+    def set_state(self, state):
+        state = copy.deepcopy(state)
+        self.vehicle_waiting_time = state["vehicle_waiting_time"]
+        self.vehicle_trajectory = state["vehicle_trajectory"]
+        self.history_vehicles = state["history_vehicles"]
+        self.active_vehicles = state["active_vehicles"]
+        self.departed_vehicles = state["departed_vehicles"]
+        self.passed_vehicles = state["passed_vehicles"]
+        self.vehicles_on_lane = state["vehicles_on_lane"]
+
+    def get_passed_vehicles(self, intersection_id, since):
+        """
+        Return records (time, vehicle_id, time_spent_on_lane) of vehicles that left an incoming lane of the
+        intersection after time `since`, requires the vehicle_trajectory tracker
+        """
+        passed = self.passed_vehicles[intersection_id]
+        records = []
+        for record in reversed(passed):
+            if record[0] <= since:
+                break
+            records.append(record)
+        records.reverse()
+        return records
+
+    def _leave_lane(self, vehicle):
+        self.vehicles_on_lane.discard(vehicle)
+        lane, enter_time, time_spent = self.vehicle_trajectory[vehicle][-1]
+        iid = self.lane_intersection.get(lane)
+        if iid is None:
+            return
+        passed = self.passed_vehicles[iid]
+        leave_time = enter_time + time_spent
+        passed.append((leave_time, vehicle, time_spent))
+        while passed and passed[0][0] <= leave_time - self.retention:
+            passed.popleft()
+
+    def _update_vehicle_waiting_time(self):
+        # the waiting time of vehicle since last halt.
+        vehicle_speed = self.world.query("vehicle_speed")
+        for vehicle in self.vehicles:
+            if vehicle not in self.vehicle_waiting_time:
+                self.vehicle_waiting_time[vehicle] = 0
+            if vehicle_speed[vehicle] < 0.1:
+                self.vehicle_waiting_time[vehicle] += 1
+            else:
+                self.vehicle_waiting_time[vehicle] = 0
+
+    def _update_vehicle_trajectory(self):
+        # lane_id and time spent on the corresponding lane that each vehicle went through
+        vehicle_lane = self.world.get_vehicle_lane()
+        current_time = int(self.current_time)
+        for vehicle in self.vehicles:
+            if vehicle not in vehicle_lane:
+                # the vehicle is crossing an intersection
+                if vehicle in self.vehicles_on_lane:
+                    self._leave_lane(vehicle)
+                continue
+            if vehicle not in self.vehicle_trajectory:
+                self.vehicle_trajectory[vehicle] = [[vehicle_lane[vehicle], current_time, 0]]
+            elif vehicle_lane[vehicle] == self.vehicle_trajectory[vehicle][-1][0]:
+                self.vehicle_trajectory[vehicle][-1][2] += 1
+            else:
+                if vehicle in self.vehicles_on_lane:
+                    self._leave_lane(vehicle)
+                self.vehicle_trajectory[vehicle].append([vehicle_lane[vehicle], current_time, 0])
+            self.vehicles_on_lane.add(vehicle)
+
+    def _update_history_vehicles(self):
+        self.history_vehicles.update(self.vehicles)
@@ -3,125 +3,251 @@ import os.path as osp
 import cityflow
 
 import numpy as np
-from math import atan2, pi
+from tracker import VehicleTracker
+from topology import load_topology
+from profiler import Profiler
 import sys
 
 
-def _get_direction(road, out=True):
-    if out:
-        x = road["points"][1]["x"] - road["points"][0]["x"]
-        y = road["points"][1]["y"] - road["points"][0]["y"]
-    else:
-        x = road["points"][-2]["x"] - road["points"][-1]["x"]
-        y = road["points"][-2]["y"] - road["points"][-1]["y"]
-    tmp = atan2(x, y)
-    return tmp if tmp >= 0 else (tmp + 2 * pi)
+class CSRMatrix(object):
+    """
+    Minimal compressed sparse row matrix, used for the intersection-lane incidence of the roadnet
+
+    Parameters
+    ----------
+    indptr : array of shape (n_rows + 1,), row i holds entries indptr[i]:indptr[i+1]
+    indices : column index of each entry
+    data : value of each entry
+    n_cols : number of columns
+    """
+    def __init__(self, indptr, indices, data, n_cols):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float32)
+        self.shape = (len(self.indptr) - 1, n_cols)
+        # row index of each entry, so that mat-vec products reduce to one bincount
+        self.rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    @classmethod
+    def from_index_rows(cls, rows, n_cols, values=None):
+        """
+        Build the matrix from a list of rows, each row being an array of column indices, with values
+        (a list of arrays matching rows) as entries, or ones if values is None
+        """
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        data = np.concatenate(values) if values else np.ones(len(indices), dtype=np.float32)
+        return cls(indptr, indices, data, n_cols)
+
+    def dot(self, x):
+        return np.bincount(self.rows, weights=self.data * x[self.indices], minlength=self.shape[0])
+
+
+class LaneSnapshot(object):
+    """
+    Lane statistics of the current simulation step as contiguous float32 arrays, aligned to world.all_lanes.
+    Each statistic is converted once from its info function on first access.
+
+    Parameters
+    ----------
+    world : World object
+    """
+    def __init__(self, world):
+        self.world = world
+        self.lane_index = world.lane_index
+        self.arrays = {}
+
+    def __getitem__(self, name):
+        if not name in self.arrays:
+            values = self.world.get_info(name)
+            lanes = self.world.all_lanes
+            self.arrays[name] = np.fromiter((values[lane] for lane in lanes), dtype=np.float32, count=len(lanes))
+        return self.arrays[name]
 
 
 class Intersection(object):
-    def __init__(self, intersection, world):
-        self.id = intersection["id"]
+    def __init__(self, topology, index, world):
+        self.index = index  # index in world.topology
+        self.id = str(topology.intersection_ids[index])
+        self.point = tuple(topology.intersection_points[index].tolist())
         self.eng = world.eng
+        # phase state is kept by the World's PhaseController, see bind()
+        self.controller = None
+        self.row = None
+        all_roads = world.all_roads
+        all_lanes = world.all_lanes
 
         # incoming and outgoing roads of each intersection, clock-wise order from North
-        self.roads = []
-        self.outs = []
-        self.directions = []
-        self.out_roads = None
-        self.in_roads = None
-
-        # links and phase information of each intersection
-        self.roadlinks = []
-        self.lanelinks_of_roadlink = []
-        self.startlanes = []
-        self.lanelinks = []
-        self.phase_available_roadlinks = []
-        self.phase_available_lanelinks = []
-        self.phase_available_startlanes = []
+        start, end = topology.intersection_road_indptr[index:index + 2]
+        outs = np.asarray(topology.intersection_road_out[start:end])
+        self.road_indices = np.asarray(topology.intersection_roads[start:end])
+        self.out_road_indices = self.road_indices[outs]
+        self.in_road_indices = self.road_indices[~outs]
+        self.outs = outs.tolist()
+        self.directions = topology.intersection_road_direction[start:end].tolist()
+        self.roads = [all_roads[road] for road in self.road_indices]
+        self.out_roads = [all_roads[road] for road in self.out_road_indices]
+        self.in_roads = [all_roads[road] for road in self.in_road_indices]
+
+        # links and phase information of each intersection, lanes are also given as indices in world.all_lanes
+        start, end = topology.intersection_roadlink_indptr[index:index + 2]
+        self.roadlinks = list(zip([all_roads[road] for road in topology.roadlink_start_road[start:end]],
+                                  [all_roads[road] for road in topology.roadlink_end_road[start:end]]))
+        lanelink_indptr = np.asarray(topology.roadlink_lanelink_indptr[start:end + 1])
+        self.lanelink_start_lanes = np.asarray(topology.lanelink_start_lane[lanelink_indptr[0]:lanelink_indptr[-1]])
+        self.lanelink_end_lanes = np.asarray(topology.lanelink_end_lane[lanelink_indptr[0]:lanelink_indptr[-1]])
+        lanelink_indptr = lanelink_indptr - lanelink_indptr[0]
+        self.lanelinks = list(zip([all_lanes[lane] for lane in self.lanelink_start_lanes],
+                                  [all_lanes[lane] for lane in self.lanelink_end_lanes]))
+        self.lanelinks_of_roadlink = [self.lanelinks[lanelink_indptr[i]:lanelink_indptr[i + 1]]
+                                      for i in range(len(self.roadlinks))]
+        self.startlane_indices = np.array(sorted(set(self.lanelink_start_lanes.tolist())), dtype=np.int64)
+        self.startlanes = [all_lanes[lane] for lane in self.startlane_indices]
 
         # define yellow phases, currently default to 0
         self.yellow_phase_id = [0]
         self.yellow_phase_time = 3
 
-        # parsing links and phases
-        for roadlink in intersection["roadLinks"]:
-            self.roadlinks.append((roadlink["startRoad"], roadlink["endRoad"]))
-            lanelinks = []
-            for lanelink in roadlink["laneLinks"]:
-                startlane = roadlink["startRoad"] + "_" + str(lanelink["startLaneIndex"])
-                self.startlanes.append(startlane)
-                endlane = roadlink["endRoad"] + "_" + str(lanelink["endLaneIndex"])
-                lanelinks.append((startlane, endlane))
-            self.lanelinks.extend(lanelinks)
-            self.lanelinks_of_roadlink.append(lanelinks)
-
-        self.startlanes = list(set(self.startlanes))
-
-        phases = intersection["trafficLight"]["lightphases"]
-        self.phases = [i for i in range(len(phases)) if not i in self.yellow_phase_id]
+        # available roadlinks and lanelinks of each phase, lanelinks are indices in self.lanelinks
+        start, end = topology.intersection_phase_indptr[index:index + 2]
+        phase_roadlink_indptr = topology.phase_roadlink_indptr[start:end + 1]
+        self.phases = [i for i in range(end - start) if not i in self.yellow_phase_id]
+        self.phase_available_roadlinks = []
+        self.phase_lanelinks = []
+        self.phase_available_lanelinks = []
+        self.phase_startlane_indices = []
+        self.phase_available_startlanes = []
         for i in self.phases:
-            phase = phases[i]
-            self.phase_available_roadlinks.append(phase["availableRoadLinks"])
-            phase_available_lanelinks = []
-            phase_available_startlanes = []
-            for roadlink_id in phase["availableRoadLinks"]:
-                lanelinks_of_roadlink = self.lanelinks_of_roadlink[roadlink_id]
-                phase_available_lanelinks.extend(lanelinks_of_roadlink)
-                for lanelinks in lanelinks_of_roadlink:
-                    phase_available_startlanes.append(lanelinks[0])
-            self.phase_available_lanelinks.append(phase_available_lanelinks)
-            phase_available_startlanes = list(set(phase_available_startlanes))
-            self.phase_available_startlanes.append(phase_available_startlanes)
-
-        self.reset()
-
-    def insert_road(self, road, out):
-        self.roads.append(road)
-        self.outs.append(out)
-        self.directions.append(_get_direction(road, out))
-
-    def sort_roads(self, RIGHT):
-        order = sorted(range(len(self.roads)),
-                       key=lambda i: (self.directions[i], self.outs[i] if RIGHT else not self.outs[i]))
-        self.roads = [self.roads[i] for i in order]
-        self.directions = [self.directions[i] for i in order]
-        self.outs = [self.outs[i] for i in order]
-        self.out_roads = [self.roads[i] for i, x in enumerate(self.outs) if x]
-        self.in_roads = [self.roads[i] for i, x in enumerate(self.outs) if not x]
-
-    def _change_phase(self, phase, interval):
-        self.eng.set_tl_phase(self.id, phase)
-        self._current_phase = phase
-        self.current_phase_time = interval
-
-    def step(self, action, interval):
-        # if current phase is yellow, then continue to finish the yellow phase
-        # recall self._current_phase means true phase id (including yellows)
-        # self.current_phase means phase id in self.phases (excluding yellow)
-        if self._current_phase in self.yellow_phase_id:
-            if self.current_phase_time >= self.yellow_phase_time:
-                self._change_phase(self.phases[self.action_before_yellow], interval)
-                self.current_phase = self.action_before_yellow
-            else:
-                self.current_phase_time += interval
+            roadlinks = topology.phase_roadlinks[phase_roadlink_indptr[i]:phase_roadlink_indptr[i + 1]].tolist()
+            self.phase_available_roadlinks.append(roadlinks)
+            lanelinks = np.array([j for roadlink in roadlinks
+                                  for j in range(lanelink_indptr[roadlink], lanelink_indptr[roadlink + 1])], dtype=np.int64)
+            self.phase_lanelinks.append(lanelinks)
+            self.phase_available_lanelinks.append([self.lanelinks[j] for j in lanelinks])
+            startlanes = np.array(sorted(set(self.lanelink_start_lanes[lanelinks].tolist())), dtype=np.int64)
+            self.phase_startlane_indices.append(startlanes)
+            self.phase_available_startlanes.append([all_lanes[lane] for lane in startlanes])
+
+    def bind(self, controller, row):
+        self.controller = controller
+        self.row = row
+
+    @property
+    def current_phase(self):
+        # phase id in self.phases (excluding yellow)
+        return int(self.controller.current_phase[self.row])
+
+    @property
+    def _current_phase(self):
+        # true phase id (including yellow)
+        return int(self.controller.true_phase[self.row])
+
+    @property
+    def current_phase_time(self):
+        return self.controller.phase_time[self.row].item()
+
+    @property
+    def action_before_yellow(self):
+        action = int(self.controller.action_before_yellow[self.row])
+        return None if action < 0 else action
+
+    @property
+    def yellow_phase_time(self):
+        return self.controller.yellow_phase_time[self.row].item()
+
+    @yellow_phase_time.setter
+    def yellow_phase_time(self, yellow_phase_time):
+        if self.controller is None:
+            self._yellow_phase_time = yellow_phase_time
         else:
-            if action == self.current_phase:
-                self.current_phase_time += interval
-            else:
-                if self.yellow_phase_time > 0:
-                    self._change_phase(self.yellow_phase_id[0], interval)
-                    self.action_before_yellow = action
-                else:
-                    self._change_phase(action, interval)
-                    self.current_phase = action
+            self.controller.yellow_phase_time[self.row] = yellow_phase_time
 
     def reset(self):
-        # record phase info
-        self.current_phase = 0  # phase id in self.phases (excluding yellow)
-        self._current_phase = self.phases[0]  # true phase id (including yellow)
-        self.eng.set_tl_phase(self.id, self._current_phase)
-        self.current_phase_time = 0
-        self.action_before_yellow = None
+        self.controller.reset([self.row])
+
+
+class PhaseController(object):
+    """
+    Traffic light state of all intersections, kept in arrays and updated at once each step.
+    The engine is only called for intersections whose phase changes.
+
+    Parameters
+    ----------
+    intersections : list of Intersection, bound to the rows of the controller
+    eng : CityFlow engine
+    """
+    def __init__(self, intersections, eng):
+        self.eng = eng
+        self.intersection_ids = [I.id for I in intersections]
+        n = len(intersections)
+        # true phase id of each action, padded with the last phase for intersections with fewer phases
+        max_phases = max([len(I.phases) for I in intersections] + [1])
+        self.phases = np.zeros((n, max_phases), dtype=np.int64)
+        for i, I in enumerate(intersections):
+            if I.phases:
+                self.phases[i, :len(I.phases)] = I.phases
+                self.phases[i, len(I.phases):] = I.phases[-1]
+        self.yellow_phase = np.array([I.yellow_phase_id[0] for I in intersections], dtype=np.int64)
+        self.yellow_phase_time = np.array([I._yellow_phase_time for I in intersections])
+
+        self.current_phase = np.zeros(n, dtype=np.int64)  # phase id in phases (excluding yellow)
+        self.true_phase = np.zeros(n, dtype=np.int64)  # true phase id (including yellow)
+        self.phase_time = np.zeros(n, dtype=np.float64)
+        self.action_before_yellow = np.full(n, -1, dtype=np.int64)  # -1 means None
+        for i, I in enumerate(intersections):
+            I.bind(self, i)
+        self.reset()
+
+    def _set_engine_phases(self, rows):
+        for i in rows:
+            self.eng.set_tl_phase(self.intersection_ids[i], int(self.true_phase[i]))
+
+    def reset(self, rows=None):
+        if rows is None:
+            rows = np.arange(len(self.intersection_ids))
+        rows = np.asarray(rows, dtype=np.int64)
+        self.current_phase[rows] = 0
+        self.true_phase[rows] = self.phases[rows, 0]
+        self.phase_time[rows] = 0
+        self.action_before_yellow[rows] = -1
+        self._set_engine_phases(rows.tolist())
+
+    def step(self, actions, interval):
+        """
+        Apply the actions (phase ids in Intersection.phases) of all intersections for one step of interval seconds
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        yellow = self.true_phase == self.yellow_phase
+        # a finished yellow phase switches to the action chosen before it
+        yellow_done = yellow & (self.phase_time >= self.yellow_phase_time)
+        # a new action first goes through the yellow phase, unless yellow_phase_time is 0
+        switch = ~yellow & (actions != self.current_phase)
+        switch_yellow = switch & (self.yellow_phase_time > 0)
+        switch_direct = switch & ~switch_yellow
+
+        self.current_phase[yellow_done] = self.action_before_yellow[yellow_done]
+        self.action_before_yellow[switch_yellow] = actions[switch_yellow]
+        self.current_phase[switch_direct] = actions[switch_direct]
+        self.true_phase[yellow_done | switch_direct] = self.phases[yellow_done | switch_direct,
+                                                                   self.current_phase[yellow_done | switch_direct]]
+        self.true_phase[switch_yellow] = self.yellow_phase[switch_yellow]
+
+        changed = yellow_done | switch
+        self.phase_time += interval
+        self.phase_time[changed] = interval
+        self._set_engine_phases(np.flatnonzero(changed).tolist())
+
+    def get_state(self):
+        return (self.current_phase.copy(), self.true_phase.copy(), self.phase_time.copy(), self.action_before_yellow.copy())
+
+    def set_state(self, state):
+        current_phase, true_phase, phase_time, action_before_yellow = state
+        self.current_phase[:] = current_phase
+        self.true_phase[:] = true_phase
+        self.phase_time[:] = phase_time
+        self.action_before_yellow[:] = action_before_yellow
+        self._set_engine_phases(range(len(self.intersection_ids)))
 
 
 class World(object):
@@ -129,97 +255,108 @@ class World(object):
     Create a CityFlow engine and maintain informations about CityFlow world
     """
 
-    def __init__(self, cityflow_config, thread_num):
+    def __init__(self, cityflow_config, thread_num, vehicle_retention=300, profiler=None, topology_cache="cache/topology"):
         print("building world...")
+        # timing of simulation sections, disabled unless an enabled Profiler is given
+        self.profiler = profiler if profiler is not None else Profiler()
         self.eng = cityflow.Engine(cityflow_config, thread_num=thread_num)
         with open(cityflow_config) as f:
             cityflow_config = json.load(f)
-        self.roadnet = self._get_roadnet(cityflow_config)
         self.RIGHT = True  # vehicles moves on the right side, currently always set to true due to CityFlow's mechanism
         self.interval = cityflow_config["interval"]
 
-        # get all non virtual intersections
-        self.intersections = [i for i in self.roadnet["intersections"] if not i["virtual"]]
-        self.intersection_ids = [i["id"] for i in self.intersections]
+        # compiled roadnet topology, cached in topology_cache (if not None) and memory-mapped on later runs
+        print("loading topology...")
+        roadnet_file = osp.join(cityflow_config["dir"], cityflow_config["roadnetFile"])
+        self.topology = load_topology(roadnet_file, topology_cache)
+
+        # id of all roads and lanes
+        self.all_roads = self.topology.road_ids.tolist()
+        self.all_lanes = self.topology.lane_ids.tolist()
+        self.lane_index = {lane: idx for idx, lane in enumerate(self.all_lanes)}
+        print("topology loaded.")
 
         # create non-virtual Intersections
         print("creating intersections...")
-        non_virtual_intersections = [i for i in self.roadnet["intersections"] if not i["virtual"]]
-        self.intersections = [Intersection(i, self) for i in non_virtual_intersections]
-        self.intersection_ids = [i["id"] for i in non_virtual_intersections]
+        non_virtual_intersections = np.flatnonzero(~np.asarray(self.topology.intersection_virtual))
+        self.intersections = [Intersection(self.topology, idx, self) for idx in non_virtual_intersections.tolist()]
+        self.intersection_ids = [i.id for i in self.intersections]
         self.id2intersection = {i.id: i for i in self.intersections}
+        self.phase_controller = PhaseController(self.intersections, self.eng)
         print("intersections created.")
 
-        # id of all roads and lanes
-        print("parsing roads...")
-        self.all_roads = []
-        self.all_lanes = []
-
-        for road in self.roadnet["roads"]:
-            self.all_roads.append(road["id"])
-            i = 0
-            for _ in road["lanes"]:
-                self.all_lanes.append(road["id"] + "_" + str(i))
-                i += 1
-
-            iid = road["startIntersection"]
-            if iid in self.intersection_ids:
-                self.id2intersection[iid].insert_road(road, True)
-            iid = road["endIntersection"]
-            if iid in self.intersection_ids:
-                self.id2intersection[iid].insert_road(road, False)
-
-        for i in self.intersections:
-            i.sort_roads(self.RIGHT)
-        print("roads parsed.")
-
-        # initializing info functions
-        self.info_functions = {
-            "vehicles": (lambda: self.eng.get_vehicles(include_waiting=True)),
-            "lane_count": self.eng.get_lane_vehicle_count,
-            "lane_waiting_count": self.eng.get_lane_waiting_vehicle_count,
-            "lane_vehicles": self.eng.get_lane_vehicles,
-            "time": self.eng.get_current_time,
+        # intersection-lane incidence, built once for vectorized statistics
+        in_lanes = [self.topology.roads_lane_indices(i.in_road_indices) for i in self.intersections]
+        out_lanes = [self.topology.roads_lane_indices(i.out_road_indices) for i in self.intersections]
+        self.in_lane_matrix = CSRMatrix.from_index_rows(in_lanes, len(self.all_lanes))
+        # pressure of an intersection: vehicles on incoming lanes minus vehicles on outgoing lanes
+        self.pressure_matrix = CSRMatrix.from_index_rows(
+            [np.concatenate([in_row, out_row]) for in_row, out_row in zip(in_lanes, out_lanes)], len(self.all_lanes),
+            [np.concatenate([np.ones(len(in_row)), -np.ones(len(out_row))]) for in_row, out_row in zip(in_lanes, out_lanes)])
+
+        # raw CityFlow queries, fetched at most once per step and shared by info functions and trackers
+        self.engine_queries = {
+            "vehicles": (lambda: self.eng.get_vehicles(include_waiting=False)),
+            "vehicles_including_waiting": (lambda: self.eng.get_vehicles(include_waiting=True)),
+            "vehicle_speed": self.eng.get_vehicle_speed,
             "vehicle_distance": self.eng.get_vehicle_distance,
+            "lane_vehicles": self.eng.get_lane_vehicles,
+            "lane_vehicle_count": self.eng.get_lane_vehicle_count,
+            "lane_waiting_vehicle_count": self.eng.get_lane_waiting_vehicle_count,
+            "current_time": self.eng.get_current_time
+        }
+        self.query_cache = {}
+        self.engine_calls = {} # key: query, value: number of engine calls made for it in the current step
+
+        # initializing info functions, computed lazily on first access in each step
+        self.info_functions = {
+            "vehicles": (lambda: self.query("vehicles_including_waiting")),
+            "lane_count": (lambda: self.query("lane_vehicle_count")),
+            "lane_waiting_count": (lambda: self.query("lane_waiting_vehicle_count")),
+            "lane_vehicles": (lambda: self.query("lane_vehicles")),
+            "time": (lambda: self.query("current_time")),
+            "vehicle_distance": (lambda: self.query("vehicle_distance")),
             "pressure": self.get_pressure,
             "lane_waiting_time_count": self.get_lane_waiting_time_count,
             "lane_delay": self.get_lane_delay,
-            "vehicle_trajectory": self.get_vehicle_trajectory,
-            "history_vehicles": self.get_history_vehicles
+            "vehicle_trajectory": (lambda: self.tracker.vehicle_trajectory),
+            "history_vehicles": (lambda: self.tracker.history_vehicles)
+        }
+        # stateful trackers, these have to observe every step and are updated eagerly.
+        # records of departed vehicles are evicted after vehicle_retention seconds
+        self.tracker = VehicleTracker(self, retention=vehicle_retention)
+        # other info functions each info function is computed from
+        self.info_dependencies = {
+            "pressure": ["lane_count"]
+        }
+        # trackers required by each info function
+        self.info_trackers = {
+            "lane_waiting_time_count": ["vehicle_waiting_time"],
+            "vehicle_trajectory": ["vehicle_trajectory"],
+            "history_vehicles": ["history_vehicles"]
         }
         self.fns = []
         self.info = {}
-
-        self.vehicle_waiting_time = {} # key: vehicle_id, value: the waiting time of this vehicle since last halt.
-        self.vehicle_trajectory = {} # key: vehicle_id, value: [[lane_id_1, enter_time, time_spent_on_lane_1], ... , [lane_id_n, enter_time, time_spent_on_lane_n]]
-        self.history_vehicles = set()
+        self.lane_snapshot = None
 
         print("world built.")
 
+    def query(self, name):
+        """
+        Return the result of a raw CityFlow query of the current step, the engine is called once per step at most
+        """
+        if not name in self.query_cache:
+            self.query_cache[name] = self.engine_queries[name]()
+            self.engine_calls[name] = self.engine_calls.get(name, 0) + 1
+        return self.query_cache[name]
+
+    def get_engine_call_count(self):
+        # number of engine queries made in the current step
+        return sum(self.engine_calls.values())
+
     def get_pressure(self):
-        vehicles = self.eng.get_lane_vehicle_count()
-        pressures = {}
-        for i in self.intersections:
-            pressure = 0
-            in_lanes = []
-            for road in i.in_roads:
-                from_zero = (road["startIntersection"] == i.id) if self.RIGHT else (
-                        road["endIntersection"] == i.id)
-                for n in range(len(road["lanes"]))[::(1 if from_zero else -1)]:
-                    in_lanes.append(road["id"] + "_" + str(n))
-            out_lanes = []
-            for road in i.out_roads:
-                from_zero = (road["endIntersection"] == i.id) if self.RIGHT else (
-                        road["startIntersection"] == i.id)
-                for n in range(len(road["lanes"]))[::(1 if from_zero else -1)]:
-                    out_lanes.append(road["id"] + "_" + str(n))
-            for lane in vehicles.keys():
-                if lane in in_lanes:
-                    pressure += vehicles[lane]
-                if lane in out_lanes:
-                    pressure -= vehicles[lane]
-            pressures[i.id] = pressure
-        return pressures
+        pressures = self.pressure_matrix.dot(self.get_lane_snapshot()["lane_count"])
+        return dict(zip(self.intersection_ids, pressures.tolist()))
 
     # return [self.dic_lane_waiting_vehicle_count_current_step[lane] for lane in self.list_entering_lanes] + \
     # [-self.dic_lane_waiting_vehicle_count_current_step[lane] for lane in self.list_exiting_lanes]
@@ -227,30 +364,17 @@ class World(object):
     def get_vehicle_lane(self):
         # get the current lane of each vehicle. {vehicle_id: lane_id}
         vehicle_lane = {}
-        lane_vehicles = self.eng.get_lane_vehicles()
+        lane_vehicles = self.query("lane_vehicles")
         for lane in self.all_lanes:
             for vehicle in lane_vehicles[lane]:
                 vehicle_lane[vehicle] = lane
         return vehicle_lane
 
-    def get_vehicle_waiting_time(self):
-        # the waiting time of vehicle since last halt.
-        vehicles = self.eng.get_vehicles(include_waiting=False)
-        vehicle_speed = self.eng.get_vehicle_speed()
-        for vehicle in vehicles:
-            if vehicle not in self.vehicle_waiting_time.keys():
-                self.vehicle_waiting_time[vehicle] = 0
-            if vehicle_speed[vehicle] < 0.1:
-                self.vehicle_waiting_time[vehicle] += 1
-            else:
-                self.vehicle_waiting_time[vehicle] = 0
-        return self.vehicle_waiting_time
-
     def get_lane_waiting_time_count(self):
         # the sum of waiting times of vehicles on the lane since their last halt.
         lane_waiting_time = {}
-        lane_vehicles = self.eng.get_lane_vehicles()
-        vehicle_waiting_time = self.get_vehicle_waiting_time()
+        lane_vehicles = self.query("lane_vehicles")
+        vehicle_waiting_time = self.tracker.vehicle_waiting_time
         for lane in self.all_lanes:
             lane_waiting_time[lane] = 0
             for vehicle in lane_vehicles[lane]:
@@ -261,10 +385,10 @@ class World(object):
         # the delay of each lane: 1 - lane_avg_speed/speed_limit
         # set speed limit to 11.11 by default
         speed_limit = 11.11
-        lane_vehicles = self.eng.get_lane_vehicles()
+        lane_vehicles = self.query("lane_vehicles")
         lane_delay = {}
         lanes = self.all_lanes
-        vehicle_speed = self.eng.get_vehicle_speed()
+        vehicle_speed = self.query("vehicle_speed")
 
         for lane in lanes:
             vehicles = lane_vehicles[lane]
@@ -280,32 +404,6 @@ class World(object):
             lane_delay[lane] = 1 - lane_avg_speed / speed_limit
         return lane_delay
 
-    def get_vehicle_trajectory(self):
-        # lane_id and time spent on the corresponding lane that each vehicle went through
-        vehicle_lane = self.get_vehicle_lane()
-        vehicles = self.eng.get_vehicles(include_waiting=False)
-        for vehicle in vehicles:
-            if vehicle not in self.vehicle_trajectory:
-                self.vehicle_trajectory[vehicle] = [[vehicle_lane[vehicle], int(self.eng.get_current_time()), 0]]
-            else:
-                if vehicle not in vehicle_lane.keys():
-                    continue
-                if vehicle_lane[vehicle] == self.vehicle_trajectory[vehicle][-1][0]:
-                    self.vehicle_trajectory[vehicle][-1][2] += 1
-                else:
-                    self.vehicle_trajectory[vehicle].append([vehicle_lane[vehicle], int(self.eng.get_current_time()), 0])
-        return self.vehicle_trajectory
-
-    def get_history_vehicles(self):
-        self.history_vehicles.update(self.eng.get_vehicles())
-        return self.history_vehicles
-
-
-    def _get_roadnet(self, cityflow_config):
-        roadnet_file = osp.join(cityflow_config["dir"], cityflow_config["roadnetFile"])
-        with open(roadnet_file) as f:
-            roadnet = json.load(f)
-        return roadnet
 
     def subscribe(self, fns):
         if isinstance(fns, str):
@@ -314,30 +412,76 @@ class World(object):
             if fn in self.info_functions:
                 if not fn in self.fns:
                     self.fns.append(fn)
+                self.subscribe(self.info_dependencies.get(fn, []))
+                for tracker in self.info_trackers.get(fn, []):
+                    self.tracker.enable(tracker)
             else:
                 raise Exception("info function %s not exists" % fn)
 
     def step(self, actions=None):
         if actions is not None:
-            for i, action in enumerate(actions):
-                self.intersections[i].step(action, self.interval)
-        self.eng.next_step()
-        self._update_infos()
+            with self.profiler.timer("world.set_phases"):
+                self.phase_controller.step(actions, self.interval)
+        with self.profiler.timer("world.next_step"):
+            self.eng.next_step()
+        with self.profiler.timer("world.update_trackers"):
+            self._update_trackers()
 
     def reset(self):
         self.eng.reset()
-        for I in self.intersections:
-            I.reset()
-        self._update_infos()
+        self.phase_controller.reset()
+        self.tracker.clear()
+        self._update_trackers()
+
+    def snapshot(self):
+        """
+        Capture the state of the engine, of the trackers and of the intersections, which can be restored later
+        with restore(), e.g. to restart episodes from a warmed-up network
+        """
+        if not hasattr(self.eng, "snapshot"):
+            raise Exception("engine snapshot is not supported by this version of CityFlow")
+        return {
+            "engine": self.eng.snapshot(),
+            "tracker": self.tracker.get_state(),
+            "intersections": self.phase_controller.get_state()
+        }
 
-    def _update_infos(self):
+    def restore(self, snapshot):
+        """
+        Restore a state captured by snapshot(), the snapshot can be restored several times
+        """
+        self.eng.load(snapshot["engine"])
+        self.tracker.set_state(snapshot["tracker"])
+        self.phase_controller.set_state(snapshot["intersections"])
+        self._invalidate_infos()
+
+    def _update_trackers(self):
+        # invalidate infos of the last step, then let the trackers observe the new one
+        self._invalidate_infos()
+        self.tracker.update()
+
+    def _invalidate_infos(self):
         self.info = {}
-        for fn in self.fns:
-            self.info[fn] = self.info_functions[fn]()
+        self.lane_snapshot = None
+        self.query_cache = {}
+        self.engine_calls = {}
 
     def get_info(self, info):
+        if not info in self.info:
+            if not info in self.fns:
+                raise Exception("info function %s not subscribed" % info)
+            with self.profiler.timer("info." + info):
+                self.info[info] = self.info_functions[info]()
         return self.info[info]
 
+    def get_lane_snapshot(self):
+        """
+        Return the LaneSnapshot of the current step, lane statistics in it are only available if subscribed
+        """
+        if self.lane_snapshot is None:
+            self.lane_snapshot = LaneSnapshot(self)
+        return self.lane_snapshot
+
 
 if __name__ == "__main__":
     world = World("examples/config.json", thread_num=1)